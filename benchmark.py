@@ -0,0 +1,250 @@
+# Seeds a synthetic shop database and drives the storefront flows through the Flask test client.
+#
+#   python benchmark.py --products 5000 --orders 20000 --requests 300 --output bench.json
+#
+# Also times importing main.py in fresh interpreters and records their peak RSS (--startup-runs).
+#
+# Runs against a scratch SQLite file (or --database), never against db/user.db.
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+WORDS = ['Trà', 'Cà phê', 'Sữa', 'Đào', 'Vải', 'Cam', 'Sả', 'Chanh', 'Xoài', 'Bơ', 'Dâu', 'Matcha', 'Socola',
+         'Trân châu', 'Kem', 'Muối', 'Đá xay', 'Nóng', 'Dừa', 'Việt quất']
+SIZES = ['S', 'M', 'L']
+LEVELS = ['0', '50', '100']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Storefront benchmark')
+    parser.add_argument('--types', type=int, default=12)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--carts', type=int, default=100, help='users that start with items in their cart')
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--startup-runs', type=int, default=5, help='fresh interpreters to time importing main.py in')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--database', help='SQLAlchemy URL, defaults to a temporary SQLite file')
+    parser.add_argument('--output', default='bench.json')
+    return parser.parse_args()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def seed(args, rng):
+    from shop.cart import sync_cart_summaries
+    from shop.migrations import upgrade_db
+    from shop.models import Cart, Order, OrderItem, OrderStatus, Product, ProductType, User, db
+    from shop.orders import apply_sell_counts, rebuild_revenue_rollup
+    from shop.recommendations import rebuild_affinity_index, rebuild_similarity_index
+    from shop.search import ensure_search_index
+
+    now = datetime.utcnow()
+    upgrade_db()
+    ensure_search_index()
+
+    db.session.execute(db.insert(OrderStatus), [
+        {'id': 1, 'status_name': 'Đang thực hiện'}, {'id': 2, 'status_name': 'Đã nhận hàng'},
+        {'id': 3, 'status_name': 'Đã hủy'}])
+    db.session.execute(db.insert(ProductType), [
+        {'id': i, 'name': f'{WORDS[i % len(WORDS)]} {i}', 'picture': f'type{i}.png'}
+        for i in range(1, args.types + 1)])
+    products = [{'id': i, 'name': ' '.join(rng.sample(WORDS, 3)), 'model': rng.randint(1, args.types),
+                 'picture': f'product{i}.png', 'price': rng.randrange(20, 80) * 1000, 'sell_count': 0,
+                 'date_added': now - timedelta(days=rng.randrange(365))} for i in range(1, args.products + 1)]
+    db.session.execute(db.insert(Product), products)
+
+    # Hashing once keeps seeding fast; every user gets the same password
+    password = User('x', 'x', 'x', 'benchmark').password
+    db.session.execute(db.insert(User), [
+        {'id': i, 'name': f'User {i}', 'email': f'user{i}@example.com', 'phone_number': f'09{i:08d}',
+         'password': password, 'role': 'user'} for i in range(1, args.users + 1)])
+
+    cart = []
+    for user_id in range(1, min(args.carts, args.users) + 1):
+        for product in rng.sample(products, 3):
+            quantity = rng.randint(1, 3)
+            cart.append({'user_id': user_id, 'product_id': product['id'], 'name': product['name'],
+                         'picture': product['picture'], 'size': rng.choice(SIZES),
+                         'sugar_level': rng.choice(LEVELS), 'ice_place': rng.choice(LEVELS),
+                         'quantity': quantity, 'total_price': product['price'] * quantity, 'date_added': now})
+    # Lines that collide on (user, product, options) are merged like the cart does
+    cart_lines = {}
+    for line in cart:
+        key = (line['user_id'], line['product_id'], line['size'], line['sugar_level'], line['ice_place'])
+        cart_lines.setdefault(key, line)
+    if cart_lines:
+        db.session.execute(db.insert(Cart), list(cart_lines.values()))
+
+    for start in range(0, args.orders, 1000):
+        orders, items = [], []
+        for order_id in range(start + 1, min(start + 1000, args.orders) + 1):
+            bought = rng.sample(products, rng.randint(1, 4))
+            lines = [(product, rng.randint(1, 3)) for product in bought]
+            orders.append({'id': order_id, 'user_id': rng.randint(1, args.users), 'name': 'Khách',
+                           'phone_number': '0900000000', 'address': 'Hà Nội', 'payment_method': 'cod', 'status_id': rng.choice([1, 2, 2, 2, 3]),
+                           'total_price': sum(product['price'] * quantity for product, quantity in lines),
+                           'order_date': now - timedelta(minutes=rng.randrange(60 * 24 * 365))})
+            items.extend({'order_id': order_id, 'product_id': product['id'], 'product_name': product['name'],
+                          'quantity': quantity, 'total_price': product['price'] * quantity, 'feature': 'M - 50 - 50'}
+                         for product, quantity in lines)
+        db.session.execute(db.insert(Order), orders)
+        db.session.execute(db.insert(OrderItem), items)
+    db.session.commit()
+
+    apply_sell_counts(db.select(Order.id).where(Order.status_id == 2).scalar_subquery())
+    db.session.commit()
+    sync_cart_summaries()
+    db.session.commit()
+    rebuild_revenue_rollup()
+    rebuild_similarity_index()
+    rebuild_affinity_index()
+    return products
+
+
+def run_route(requests, make_request, query_count, prepare=None):
+    latencies, queries, errors = [], [], 0
+    for i in range(requests):
+        if prepare:
+            prepare(i)
+        before = query_count[0]
+        request_started = time.perf_counter()
+        response = make_request(i)
+        latencies.append(time.perf_counter() - request_started)
+        queries.append(query_count[0] - before)
+        if response.status_code >= 500:
+            errors += 1
+    # Time spent in the measured requests only, not in prepare()
+    seconds = sum(latencies)
+    return {'requests': requests, 'errors': errors, 'seconds': round(seconds, 4),
+            'throughput': round(requests / seconds, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+            'queries_per_request': round(statistics.fmean(queries), 2)}
+
+
+def measure_startup(runs):
+    # What a freshly started or restarted worker pays before it can serve anything
+    script = ('import resource, time; started = time.perf_counter(); import main; '
+              'print(time.perf_counter() - started, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)')
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    rss_unit = 1 if sys.platform == 'darwin' else 1024
+    seconds, rss = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True, capture_output=True, text=True).stdout.split()
+        seconds.append(float(output[0]))
+        rss.append(int(output[1]) * rss_unit / 1024 / 1024)
+    return {'runs': runs, 'import_p50_ms': round(percentile(seconds, 0.5) * 1000, 1),
+            'import_max_ms': round(max(seconds) * 1000, 1), 'rss_p50_mb': round(percentile(rss, 0.5), 1)}
+
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    scratch = tempfile.mkdtemp(prefix='shop-benchmark-')
+    # create_app() reads FLASK_* settings when main.py is imported
+    os.environ['FLASK_SQLALCHEMY_DATABASE_URI'] = args.database or 'sqlite:///' + os.path.join(scratch, 'shop.db')
+    startup = measure_startup(args.startup_runs) if args.startup_runs else None
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from main import app
+    from shop.models import db
+    from jinja2 import ChoiceLoader, FunctionLoader
+    from sqlalchemy import event
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.instance_path = scratch
+    # Pages whose template isn't checked out still run their queries and render an empty body
+    app.jinja_loader = ChoiceLoader([app.jinja_loader, FunctionLoader(lambda name: '')])
+
+    with app.app_context():
+        started = time.perf_counter()
+        products = seed(args, rng)
+        seed_seconds = time.perf_counter() - started
+
+        query_count = [0]
+
+        def count_query(*_):
+            # Background view flushes and jobs run on their own threads and aren't part of any request
+            if threading.current_thread() is threading.main_thread():
+                query_count[0] += 1
+
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    anonymous = app.test_client()
+    customers = []
+    for user_id in range(1, min(args.users, 20) + 1):
+        client = app.test_client()
+        client.post('/login', data={'phone_number': f'09{user_id:08d}', 'password': 'benchmark'})
+        customers.append(client)
+
+    def customer(i):
+        return customers[i % len(customers)]
+
+    def random_product():
+        return rng.choice(products)
+
+    def add_to_cart(i):
+        product = random_product()
+        return customer(i).post('/cart/add', data={'id': product['id'], 'size': rng.choice(SIZES),
+                                                   'sugar_level': rng.choice(LEVELS),
+                                                   'ice_place': rng.choice(LEVELS), 'quantity': 1})
+
+    def prepare_order(i):
+        product = random_product()
+        customer(i).post('/cart/add', data={'id': product['id'], 'size': 'M', 'sugar_level': '50',
+                                            'ice_place': '50', 'quantity': 1})
+        customer(i).get('/thanhtoan')
+
+    def submit_order(i):
+        return customer(i).post('/submit_order', data={'name': 'Khách', 'number': '0900000000',
+                                                       'address': 'Hà Nội', 'dinoselect5': 'cod'})
+
+    routes = {
+        'homepage': lambda i: customer(i).get('/'),
+        'product_listing_anonymous': lambda i: anonymous.get(f'/product/{rng.randint(1, args.types)}/'),
+        'product_listing': lambda i: customer(i).get(f'/product/{rng.randint(1, args.types)}/?sort_order=asc&sort_by=times'),
+        'product_details': lambda i: customer(i).get(f"/product/details/{random_product()['id']}/"),
+        'search': lambda i: customer(i).get('/product/search', query_string={'q': rng.choice(WORDS)}),
+        'add_to_cart': add_to_cart,
+        'view_cart': lambda i: customer(i).get('/cart'),
+        'order_history': lambda i: customer(i).get('/order_history/'),
+    }
+    results = {name: run_route(args.requests, make_request, query_count)
+               for name, make_request in routes.items()}
+    results['submit_order'] = run_route(args.requests, submit_order, query_count, prepare=prepare_order)
+
+    report = {'created': datetime.utcnow().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+              'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+              'dataset': {'types': args.types, 'products': args.products, 'users': args.users,
+                          'carts': args.carts, 'orders': args.orders},
+              'startup': startup, 'requests_per_route': args.requests, 'seed_seconds': round(seed_seconds, 2),
+              'routes': results}
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(report, output, indent=2, ensure_ascii=False)
+
+    print(f"{'route':28} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}")
+    for name, result in results.items():
+        print(f"{name:28} {result['throughput']:8} {result['p50_ms']:8} {result['p95_ms']:8} "
+              f"{result['p99_ms']:8} {result['queries_per_request']:8} {result['errors']:6}")
+    if startup:
+        print(f"Importing main.py: {startup['import_p50_ms']} ms (p50), {startup['rss_p50_mb']} MB RSS")
+    print(f'Seeded in {seed_seconds:.1f}s, results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+# Read by gunicorn from the working directory:
+#
+#   gunicorn --workers 4 --bind 0.0.0.0:8000
+#
+# Behind nginx, set FLASK_PROXY_FIX_X_FOR=1 so the app sees the client's address instead of the proxy's.
+#
+# The app is imported, and the first catalog snapshot built, once in the master process, so forked workers
+# start serving without building their own. The snapshot is only shared until it is replaced: after an admin
+# edit, or once it is CATALOG_SNAPSHOT_TTL old, every worker builds and keeps a private copy.
+#
+# Similarity index jobs are not run by the web workers. Run the job runner as a service of its own next to them:
+#
+#   flask --app main run-jobs --watch
+wsgi_app = 'main:app'
+preload_app = True
+
+
+def on_starting(server):
+    # Runs in the master after the app is preloaded and before any worker is forked
+    from main import app
+    from shop.catalog import warm_catalog
+
+    warm_catalog(app)
@@ -0,0 +1,102 @@
+import functools
+import os
+from flask import Flask, url_for
+from sqlalchemy import event
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from shop import admin, cart, metrics, storefront
+from shop.bulk import export_catalog_command, export_orders_command, import_catalog_command
+from shop.cart import reconcile_carts_command
+from shop.jobs import run_jobs_command, start_job_worker
+from shop.migrations import upgrade_db_command
+from shop.models import db, set_sqlite_pragmas
+from shop.orders import rebuild_revenue_command
+from shop.recommendations import rebuild_recommendations_command, rebuild_similarity_command
+from shop.search import rebuild_search_command
+
+# Templates, static files and db/ live next to main.py, one level up
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [upgrade_db_command, run_jobs_command, reconcile_carts_command, rebuild_search_command,
+            rebuild_similarity_command, rebuild_recommendations_command, rebuild_revenue_command,
+            import_catalog_command, export_catalog_command, export_orders_command]
+
+
+def create_app():
+    app = Flask(__name__, root_path=ROOT_DIR)
+
+    app.config['SECRET_KEY'] = 'tram'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(ROOT_DIR, 'db/user.db')
+    # Applied to every pooled connection. WAL lets readers carry on while checkout writes,
+    # busy_timeout makes writers wait for the lock instead of failing with "database is locked",
+    # foreign_keys makes SQLite enforce the ON DELETE CASCADE rules like PostgreSQL does
+    app.config['SQLITE_PRAGMAS'] = {
+        'foreign_keys': 'ON',
+        'journal_mode': 'WAL',
+        'busy_timeout': 5000,
+        'synchronous': 'NORMAL',
+        'cache_size': -20000,
+        'mmap_size': 256 * 1024 * 1024,
+    }
+    # Anonymous catalog pages are served from memory and may be cached by browsers and proxies this long
+    app.config['PAGE_CACHE_MAX_AGE'] = 60
+    app.config['PAGE_CACHE_SIZE'] = 512
+    # Seconds product views wait in memory before they are written in one batch
+    app.config['VIEW_FLUSH_INTERVAL'] = 2.0
+    # Seconds between checks for queued background jobs, and the retry schedule for failing ones. Web workers
+    # run the light jobs themselves; the similarity index jobs load scikit-learn and are only run by
+    # `flask run-jobs --watch`, which has to run as a process of its own next to the web workers.
+    app.config['JOB_POLL_INTERVAL'] = 1.0
+    app.config['JOB_MAX_ATTEMPTS'] = 5
+    app.config['JOB_RETRY_DELAY'] = 30
+    # Changing the hash method upgrades each stored password the next time its owner logs in
+    app.config['PASSWORD_HASH_METHOD'] = 'scrypt:32768:8:1'
+    # Failed logins allowed per phone number and per client address within LOGIN_THROTTLE_WINDOW seconds.
+    # The per-address limit is off unless set: behind nginx every request comes from the proxy's address,
+    # so set PROXY_FIX_X_FOR to the number of proxies in front of the app before turning it on
+    app.config['LOGIN_THROTTLE_WINDOW'] = 300
+    app.config['LOGIN_MAX_FAILURES_PER_PHONE'] = 5
+    app.config['LOGIN_MAX_FAILURES_PER_IP'] = None
+    app.config['PROXY_FIX_X_FOR'] = 0
+    # Per-route timings, SQL counts and N+1 warnings, served at /metrics; off by default
+    app.config['INSTRUMENTATION'] = False
+    # Running the same statement more often than this in one request is logged as a likely N+1
+    app.config['N_PLUS_ONE_THRESHOLD'] = 10
+    # With instrumentation on, write a cProfile dump of every request into this directory
+    app.config['PROFILE_DIR'] = None
+    # Any setting can be overridden from the environment, e.g.
+    # FLASK_SQLALCHEMY_DATABASE_URI=postgresql+psycopg://shop@localhost/shop
+    app.config.from_prefixed_env()
+
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    db.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', functools.partial(set_sqlite_pragmas, app.config))
+    metrics.init_app(app)
+    app.before_request(start_job_worker)
+    for blueprint in (storefront.bp, cart.bp, admin.bp):
+        app.register_blueprint(blueprint)
+    for command in COMMANDS:
+        app.cli.add_command(command)
+
+    # Templates build URLs from the endpoint names the views had before they moved into blueprints
+    # ('login', 'product_details', ...); every view kept its name, so map each one to its blueprint
+    aliases = {rule.endpoint.rpartition('.')[2]: rule.endpoint
+               for rule in app.url_map.iter_rules() if '.' in rule.endpoint}
+    app.url_build_error_handlers.append(functools.partial(_blueprint_endpoint, aliases))
+
+    os.register_at_fork(after_in_child=functools.partial(dispose_pool_after_fork, app))
+    return app
+
+
+def _blueprint_endpoint(aliases, error, endpoint, values):
+    if endpoint in aliases:
+        return url_for(aliases[endpoint], **values)
+
+
+def dispose_pool_after_fork(app):
+    # Forked workers must not reuse connections opened by the parent process
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,359 @@
+from datetime import datetime, date, timedelta
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, abort
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, selectinload
+
+from shop.bulk import CATALOG_FIELDS, ORDER_EXPORT_FIELDS, download, export_catalog_rows, export_order_rows, \
+    file_format_for, import_catalog, read_catalog_rows, stream_rows
+from shop.cart import remove_products_from_carts
+from shop.catalog import bump_catalog_version, catalog_changed
+from shop.models import DailyRevenue, Order, Product, ProductType, User, db
+from shop.orders import ORDER_STATUS_JOBS, REVENUE_MAX_DAYS, enqueue_order_jobs, filter_orders, \
+    get_order_statuses, get_revenue_series
+from shop.pagination import get_page_args, keyset_page
+from shop.storefront import login_metrics
+
+bp = Blueprint('admin', __name__)
+
+
+@bp.route('/admin/login-metrics')
+def login_metrics_view():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        return jsonify(login_metrics)
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/')
+def admin():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        today = date.today()
+
+        # At most 366 rollup rows instead of three scans over order and order_item
+        year = DailyRevenue.query.filter(DailyRevenue.day.between(date(today.year, 1, 1), date(today.year, 12, 31))).all()
+        total_revenue_today = sum(row.revenue for row in year if row.day == today)
+        total_revenue_month = sum(row.revenue for row in year if row.day.month == today.month)
+        total_revenue_year = sum(row.revenue for row in year)
+
+        total_users = db.session.query(func.count(User.id)).scalar()
+        total_orders = db.session.query(func.sum(DailyRevenue.order_count)).scalar() or 0
+        total_products = db.session.query(func.count(Product.id)).scalar()
+
+        start, end = get_revenue_range()
+        return render_template('admin/home.html', total_revenue_today=total_revenue_today,
+                               total_revenue_month=total_revenue_month, total_revenue_year=total_revenue_year,
+                               total_users=total_users, total_orders=total_orders, total_products=total_products,
+                               revenue_series=get_revenue_series(start, end), start=start, end=end
+                               )
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+def get_revenue_range():
+    end = request.args.get('end', type=date.fromisoformat) or date.today()
+    start = request.args.get('start', type=date.fromisoformat) or end - timedelta(days=29)
+    start = max(start, end - timedelta(days=REVENUE_MAX_DAYS))
+    return start, end
+
+
+@bp.route('/admin/revenue')
+def revenue():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        start, end = get_revenue_range()
+        return jsonify(get_revenue_series(start, end))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/product')
+def index():
+    cursor, limit = get_page_args()
+    query = db.session.query(*Product.__table__.columns, ProductType.name.label('type_name'))\
+        .outerjoin(ProductType, ProductType.id == Product.model)
+    products, next_cursor = keyset_page(query, Product.id, cursor, limit)
+    # Type names come with the rows, so the template's lookups never hit the database
+    type_names = {row.model: row.type_name for row in products}
+    return render_template('admin/product.html', data=products, get_product_type_name=type_names.get,
+                           next_cursor=next_cursor, limit=limit)
+
+
+@bp.route('/add', methods=['GET', 'POST'])
+def add():
+    if request.method == 'POST':
+        name = request.form['name']
+        model = request.form['model']
+        picture = request.form['picture']
+        price = request.form['price']
+        product_id = db.session.execute(db.text('''INSERT INTO product (name, model, picture, price, sell_count, date_added)
+        VALUES (:name, :model, :picture, :price, 0, CURRENT_TIMESTAMP) RETURNING id'''),
+                                        {'name': name, 'model': model, 'picture': picture, 'price': price}).scalar()
+        db.session.commit()
+        catalog_changed(changed_ids=[product_id])
+
+        flash('Product added successfully!', 'success')
+        return redirect(url_for('.index'))
+
+    product_types = db.session.execute(db.text('SELECT id, name FROM product_type')).all()
+
+    product = {
+        'name': '',
+        'model': '',
+        'picture': '',
+        'price': '',
+    }
+
+    return render_template('admin/add_pro.html', product=product, product_types=product_types)
+
+
+@bp.route('/edit/<int:id>', methods=['GET', 'POST'])
+def edit(id):
+    if request.method == 'POST':
+        name = request.form['name']
+        model = request.form['model']
+        picture = request.form['picture']
+        price = request.form['price']
+
+        db.session.execute(db.text('''UPDATE product SET name=:name, model=:model,
+        picture=:picture, price=:price WHERE id=:id'''),
+                           {'name': name, 'model': model, 'picture': picture, 'price': price, 'id': id})
+        db.session.commit()
+        catalog_changed(changed_ids=[id])
+
+        flash('Product updated successfully!', 'success')
+        return redirect(url_for('.index'))
+
+    row = db.session.execute(db.text('SELECT * FROM product WHERE id = :id'), {'id': id}).mappings().first()
+    product_types = db.session.execute(db.text('SELECT id, name FROM product_type')).all()
+
+    product = dict(row) if row else None
+
+    return render_template('admin/edit_pro.html', product=product, product_types=product_types)
+
+
+@bp.route('/delete/<int:id>', methods=['POST'])
+def delete(id):
+    order = db.session.execute(db.text('SELECT 1 FROM order_item WHERE product_id = :id LIMIT 1'),
+                               {'id': id}).first()
+    if order:
+        flash('Không thể xóa vì sản phẩm đã được đặt hàng!', 'warning')
+    else:
+        remove_products_from_carts([id])
+        db.session.execute(db.text('DELETE FROM product WHERE id = :id'), {'id': id})
+        db.session.commit()
+        catalog_changed(deleted_ids=[id])
+        flash('Product deleted successfully!', 'success')
+
+    return redirect(url_for('.index'))
+
+
+@bp.route('/admin/catalog/import', methods=['POST'])
+def import_catalog_view():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        upload = request.files.get('file')
+        if upload is None:
+            abort(400)
+        file_format = request.form.get('format') or file_format_for(upload.filename or '')
+        return jsonify(import_catalog(read_catalog_rows(upload.stream, file_format)))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/catalog/export')
+def export_catalog_view():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        file_format = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+        return download(stream_rows(export_catalog_rows(), CATALOG_FIELDS, file_format), 'catalog', file_format)
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/category')
+def category():
+    product_types = ProductType.query.all()
+    return render_template('/admin/category.html', product_types=product_types)
+
+
+@bp.route('/admin/add_type', methods=['GET', 'POST'])
+def add_type():
+    if request.method == 'POST':
+        name = request.form['name']
+        picture = request.form['picture']
+
+        new_type = ProductType(name=name, picture=picture)
+        db.session.add(new_type)
+        db.session.commit()
+        bump_catalog_version()
+
+        flash('Product type added successfully!', 'success')
+        return redirect(url_for('.category'))
+
+    return render_template('admin/add.cat.html')
+
+
+@bp.route('/edit_type/<int:type_id>', methods=['GET', 'POST'])
+def edit_type(type_id):
+    product_type = ProductType.query.get(type_id)
+
+    if request.method == 'POST':
+        name = request.form['name']
+        picture = request.form['picture']
+        product_type.update(name, picture)
+        bump_catalog_version()
+        flash('Product type updated successfully!', 'success')
+        return redirect(url_for('.category'))
+    return render_template('admin/edit_cat.html', product_type=product_type)
+
+
+@bp.route('/delete_type/<int:type_id>', methods=['POST'])
+def delete_type(type_id):
+    product_type = ProductType.query.get(type_id)
+    if product_type:
+        product_ids = [product.id for product in product_type.products]
+        remove_products_from_carts(product_ids)
+        product_type.delete()
+        catalog_changed(deleted_ids=product_ids)
+        flash('Product type deleted successfully!', 'success')
+    else:
+        flash('Product type not found!', 'danger')
+
+    return redirect(url_for('.category'))
+
+
+@bp.route('/admin/users')
+def view_users():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        cursor, limit = get_page_args()
+        users, next_cursor = keyset_page(User.query, User.id, cursor, limit)
+        return render_template('admin/view_users.html', users=users, next_cursor=next_cursor, limit=limit)
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/delete_user/<int:user_id>', methods=['POST'])
+def delete_user(user_id):
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        user = User.query.get(user_id)
+        if user and Order.query.filter_by(user_id=user_id).first():
+            flash('Không thể xóa vì người dùng đã có đơn hàng!', 'warning')
+        elif user:
+            db.session.delete(user)
+            db.session.commit()
+            flash('User deleted successfully!', 'success')
+        else:
+            flash('User not found!', 'danger')
+
+        return redirect(url_for('.view_users'))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/update_role/<int:user_id>/<new_role>', methods=['POST'])
+def update_role(user_id, new_role):
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        user = User.query.get(user_id)
+        if user:
+            user.role = new_role
+            db.session.commit()
+            flash(f'User role updated to {new_role} successfully!', 'success')
+        else:
+            flash('User not found!', 'danger')
+
+        return redirect(url_for('.view_users'))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def get_order_filters():
+    return (request.args.get('status', type=int), request.args.get('date_from', type=_parse_date),
+            request.args.get('date_to', type=_parse_date))
+
+
+@bp.route('/admin/orders')
+def view_orders():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        cursor, limit = get_page_args()
+        status, date_from, date_to = get_order_filters()
+
+        query = filter_orders(Order.query.options(selectinload(Order.products), joinedload(Order.order_status)),
+                              status, date_from, date_to)
+        orders, next_cursor = keyset_page(query, Order.id, cursor, limit, newest_first=True)
+        order_statuses = get_order_statuses()
+        return render_template('admin/view_orders.html', orders=orders, order_statuses=order_statuses,
+                               next_cursor=next_cursor, limit=limit, status=status,
+                               date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', ''))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/orders/export')
+def export_orders_view():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        file_format = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+        rows = export_order_rows(*get_order_filters())
+        return download(stream_rows(rows, ORDER_EXPORT_FIELDS, file_format), 'orders', file_format)
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/update_order_status/<int:order_id>', methods=['POST'])
+def update_order_status(order_id):
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        new_status_str = request.form.get('new_status')
+        if new_status_str is not None:
+            new_status_id = int(new_status_str)
+
+            order = Order.query.get(order_id)
+            if order:
+                if order.status_id == 1:  # Assuming 1 is 'Đang thực hiện'
+                    # Check if the new status is valid (either 'Đã nhận hàng' or 'Đã hủy')
+                    if new_status_id in [2, 3]:  # Assuming 2 is 'Đã nhận hàng' and 3 is 'Đã hủy'
+                        order.status_id = new_status_id
+                        enqueue_order_jobs(ORDER_STATUS_JOBS[new_status_id], [order.id])
+                        db.session.commit()
+                        flash('Order status updated successfully!', 'success')
+                    else:
+                        flash('Invalid new status!', 'danger')
+                else:
+                    flash('Order status can only be updated from "Đang thực hiện"!', 'danger')
+            else:
+                flash('Order not found!', 'danger')
+                return redirect(url_for('.view_orders'))
+        return redirect(url_for('.view_orders'))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/update_product/<int:orderid>')
+def update_product(orderid):
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        # Same job as the status change queued, so following this link twice counts the order once
+        enqueue_order_jobs('order_delivered', [orderid])
+        db.session.commit()
+        flash('Product sold quantity updated successfully!', 'success')
+        return redirect(url_for('.view_orders'))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/admin/orders/deliver', methods=['POST'])
+def deliver_orders():
+    if 'current_user' in session and session['current_user']['role'] == 'admin':
+        order_ids = request.form.getlist('order_ids', type=int)
+        # Only orders still 'Đang thực hiện' move on; RETURNING tells us which ones did
+        delivered = db.session.execute(
+            db.update(Order)
+            .where(Order.id.in_(order_ids), Order.status_id == 1)
+            .values(status_id=2)
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)).scalars().all()
+        if delivered:
+            enqueue_order_jobs('order_delivered', delivered)
+        db.session.commit()
+        flash(f'{len(delivered)} orders marked as delivered!', 'success')
+        return redirect(url_for('.view_orders'))
+    else:
+        return redirect(url_for('storefront.login'))
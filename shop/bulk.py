@@ -0,0 +1,270 @@
+# Catalog import, and streaming CSV / JSON Lines exports of the catalog and of orders
+from datetime import datetime
+import csv
+import io
+import json
+import uuid
+import click
+from flask import Response, stream_with_context
+from flask.cli import with_appcontext
+
+from shop.catalog import bump_catalog_version
+from shop.jobs import enqueue_jobs
+from shop.models import Order, OrderItem, OrderStatus, Product, ProductType, db
+from shop.orders import filter_orders
+
+
+CATALOG_FIELDS = ['id', 'name', 'type', 'picture', 'price']
+IMPORT_BATCH_SIZE = 2000
+IMPORT_MAX_ERRORS = 1000
+# The largest value an INTEGER column holds on PostgreSQL
+MAX_INTEGER = 2 ** 31 - 1
+EXPORT_CHUNK_SIZE = 1000
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def file_format_for(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+class CatalogFileError(ValueError):
+    # The rest of the file can't be read; the rows before `line` are still imported
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+
+def _decoded_lines(stream):
+    # Decoded line by line rather than in buffered chunks, so an encoding error names the line it is on
+    for line_number, line in enumerate(stream, 1):
+        try:
+            yield line.decode('utf-8-sig' if line_number == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise CatalogFileError(line_number, 'the file is not UTF-8 encoded, save it as "CSV UTF-8"')
+
+
+def read_catalog_rows(stream, file_format):
+    # Reads the upload lazily, one row at a time
+    text = _decoded_lines(stream)
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as exc:
+            # DictReader.line_num only moves on once a row has been read; the underlying reader's is current
+            raise CatalogFileError(reader.reader.line_num, f'not a valid CSV file: {exc}')
+    else:
+        for line_number, line in enumerate(text, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+
+
+def _catalog_row(row):
+    if not isinstance(row, dict):
+        raise ValueError('not a valid row')
+    values = {}
+    for field, column in (('name', Product.name), ('type', ProductType.name), ('picture', Product.picture)):
+        values[field] = str(row.get(field) or '').strip()
+        if not values[field]:
+            raise ValueError(f'{field} is required')
+        if len(values[field]) > column.type.length:
+            raise ValueError(f'{field} is longer than {column.type.length} characters')
+    try:
+        values['price'] = int(row.get('price'))
+    except (TypeError, ValueError):
+        raise ValueError('price must be a whole number')
+    if not 0 <= values['price'] <= MAX_INTEGER:
+        raise ValueError(f'price must be between 0 and {MAX_INTEGER}')
+    product_id = row.get('id')
+    if product_id in (None, ''):
+        values['id'] = None
+    else:
+        try:
+            values['id'] = int(product_id)
+        except (TypeError, ValueError):
+            raise ValueError('id must be a whole number')
+        if not 0 < values['id'] <= MAX_INTEGER:
+            raise ValueError(f"no product with id {values['id']}")
+    return values
+
+
+def _import_catalog_batch(batch, types, result, error):
+    # Rows with an id update that product, rows without one add a new product
+    existing = set(db.session.execute(db.select(Product.id).where(
+        Product.id.in_([row['id'] for line, row in batch if row['id'] is not None]))).scalars())
+    rows = []
+    for line, row in batch:
+        if row['id'] is not None and row['id'] not in existing:
+            error(line, f"no product with id {row['id']}")
+        else:
+            rows.append((line, row))
+    if rows:
+        _write_catalog_rows(rows, types, result, error)
+
+
+def _write_catalog_rows(rows, types, result, error):
+    new, updated, types_created = [], {}, 0
+    try:
+        for line, row in rows:
+            if row['type'] not in types:
+                product_type = ProductType(name=row['type'], picture=row['picture'])
+                db.session.add(product_type)
+                db.session.flush()
+                types[row['type']] = product_type.id
+                types_created += 1
+            values = {'name': row['name'], 'model': types[row['type']], 'picture': row['picture'],
+                      'price': row['price']}
+            if row['id'] is None:
+                new.append(dict(values, sell_count=0, date_added=datetime.utcnow()))
+            else:
+                updated[row['id']] = dict(values, id=row['id'])
+        if new:
+            db.session.execute(db.insert(Product), new)
+        if updated:
+            db.session.execute(db.update(Product), list(updated.values()))
+        db.session.commit()
+    except Exception as exc:
+        db.session.rollback()
+        # Types added by these rows were rolled back with them
+        types.clear()
+        types.update(db.session.execute(db.select(ProductType.name, ProductType.id)).all())
+        if len(rows) == 1:
+            error(rows[0][0], f"not imported: {getattr(exc, 'orig', None) or exc}")
+        else:
+            # Something in the batch was rejected: write it again row by row, so the good rows
+            # still go in and each bad one is reported on its own line
+            for row in rows:
+                _write_catalog_rows([row], types, result, error)
+        return
+    result['imported'] += len(rows)
+    result['types_created'] += types_created
+
+
+def import_catalog(rows):
+    result = {'imported': 0, 'types_created': 0, 'error_count': 0, 'errors': []}
+
+    def error(line, message):
+        result['error_count'] += 1
+        if len(result['errors']) < IMPORT_MAX_ERRORS:
+            result['errors'].append({'line': line, 'error': message})
+
+    types = dict(db.session.execute(db.select(ProductType.name, ProductType.id)).all())
+    batch = []
+    try:
+        for line, row in rows:
+            try:
+                batch.append((line, _catalog_row(row)))
+            except ValueError as exc:
+                error(line, str(exc))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                _import_catalog_batch(batch, types, result, error)
+                batch = []
+    except CatalogFileError as exc:
+        error(exc.line, str(exc))
+    if batch:
+        _import_catalog_batch(batch, types, result, error)
+    result['errors'].sort(key=lambda item: item['line'])
+
+    # Search rows are kept up to date by the product triggers; everything else is rebuilt once
+    if result['imported']:
+        enqueue_jobs('rebuild_similarity', {f'rebuild_similarity:{uuid.uuid4().hex}': {}})
+        db.session.commit()
+        bump_catalog_version()
+    return result
+
+
+def export_catalog_rows():
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(Product.id, Product.name, ProductType.name.label('type'), Product.picture, Product.price)
+            .outerjoin(ProductType, ProductType.id == Product.model)
+            .where(Product.id > last_id).order_by(Product.id).limit(EXPORT_CHUNK_SIZE)).all()
+        if not rows:
+            return
+        for row in rows:
+            yield row._asdict()
+        last_id = rows[-1].id
+
+
+ORDER_EXPORT_FIELDS = ['order_id', 'order_date', 'status', 'user_id', 'name', 'phone_number', 'address',
+                       'payment_method', 'order_total', 'product_id', 'product_name', 'feature', 'quantity',
+                       'item_total']
+
+
+def export_order_rows(status=None, date_from=None, date_to=None):
+    statement = filter_orders(
+        db.select(Order.id.label('order_id'), Order.order_date, OrderStatus.status_name.label('status'),
+                  Order.user_id, Order.name, Order.phone_number, Order.address, Order.payment_method,
+                  Order.total_price.label('order_total'), OrderItem.product_id, OrderItem.product_name,
+                  OrderItem.feature, OrderItem.quantity, OrderItem.total_price.label('item_total'))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .join(OrderStatus, OrderStatus.id == Order.status_id)
+        .order_by(Order.id, OrderItem.id), status, date_from, date_to)
+    # yield_per streams from a server-side cursor where the driver has one, EXPORT_CHUNK_SIZE rows at a time
+    for row in db.session.execute(statement.execution_options(yield_per=EXPORT_CHUNK_SIZE)):
+        yield row._asdict()
+
+
+def stream_rows(rows, fields, file_format):
+    buffer = io.StringIO()
+    if file_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(row, ensure_ascii=False, default=str) + '\n')
+    for row in rows:
+        write(row)
+        if buffer.tell() >= STREAM_BUFFER_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def download(chunks, name, file_format):
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={name}.{file_format}'})
+
+
+@click.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']))
+@with_appcontext
+def import_catalog_command(path, file_format):
+    with open(path, 'rb') as stream:
+        result = import_catalog(read_catalog_rows(stream, file_format or file_format_for(path)))
+    for error in result['errors']:
+        print(f"line {error['line']}: {error['error']}")
+    print(f"Imported {result['imported']} products ({result['types_created']} new types), "
+          f"{result['error_count']} rows rejected")
+
+
+@click.command('export-catalog')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default='csv')
+@with_appcontext
+def export_catalog_command(output, file_format):
+    for chunk in stream_rows(export_catalog_rows(), CATALOG_FIELDS, file_format):
+        output.write(chunk)
+
+
+@click.command('export-orders')
+@click.argument('output', type=click.File('w', encoding='utf-8'), default='-')
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), default='csv')
+@click.option('--status', type=int)
+@click.option('--from', 'date_from', type=click.DateTime(['%Y-%m-%d']))
+@click.option('--to', 'date_to', type=click.DateTime(['%Y-%m-%d']))
+@with_appcontext
+def export_orders_command(output, file_format, status, date_from, date_to):
+    for chunk in stream_rows(export_order_rows(status, date_from, date_to), ORDER_EXPORT_FIELDS, file_format):
+        output.write(chunk)
@@ -0,0 +1,247 @@
+from datetime import datetime
+import uuid
+import click
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, abort
+from flask.cli import with_appcontext
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from shop.catalog import get_catalog
+from shop.models import Cart, CartSummary, Order, OrderItem, Product, User, db, dialect_insert
+from shop.orders import record_revenue
+
+bp = Blueprint('cart', __name__)
+
+
+def _cart_totals(user_id=None):
+    query = db.session.query(Cart.user_id, func.count(Cart.id), func.coalesce(func.sum(Cart.total_price), 0))
+    if user_id is not None:
+        query = query.filter(Cart.user_id == user_id)
+    return {row[0]: (row[1], row[2]) for row in query.group_by(Cart.user_id)}
+
+
+def get_cart_summary(user_id):
+    summary = db.session.get(CartSummary, user_id)
+    if summary is None:
+        # First visit since the summary table was introduced, count the cart once
+        item_count, total_value = _cart_totals(user_id).get(user_id, (0, 0))
+        summary = CartSummary(user_id=user_id, item_count=item_count, total_value=total_value)
+        db.session.add(summary)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            summary = db.session.get(CartSummary, user_id)
+    return summary
+
+
+def update_cart_summary(summary, item_delta=0, value_delta=0):
+    # Let the database apply the deltas so concurrent requests don't overwrite each other
+    summary.item_count = CartSummary.item_count + item_delta
+    summary.total_value = CartSummary.total_value + value_delta
+
+
+def sync_cart_summaries(user_ids=None, connection=None):
+    # Recount the summaries from the cart table in one statement
+    mine = Cart.user_id == CartSummary.user_id
+    statement = db.update(CartSummary).values(
+        item_count=db.select(func.count(Cart.id)).where(mine).scalar_subquery(),
+        total_value=db.select(func.coalesce(func.sum(Cart.total_price), 0)).where(mine).scalar_subquery())
+    if user_ids is not None:
+        statement = statement.where(CartSummary.user_id.in_(user_ids))
+    (connection or db.session).execute(statement.execution_options(synchronize_session=False))
+
+
+def add_cart_line(user_id, product_id, size, sugar_level, ice_place, quantity, total_price):
+    # Written straight through so every worker sees the same cart. Name and picture are copied from the
+    # product row in the same statement: a product deleted in the meantime adds nothing.
+    columns = ['user_id', 'product_id', 'name', 'picture', 'size', 'sugar_level', 'ice_place', 'quantity',
+               'total_price', 'date_added']
+    statement = dialect_insert(Cart).from_select(columns, db.select(
+        db.literal(user_id), Product.id, Product.name, Product.picture, db.literal(size), db.literal(sugar_level),
+        db.literal(ice_place), db.literal(quantity), db.literal(total_price, db.Float),
+        db.literal(datetime.utcnow(), db.DateTime)).where(Product.id == product_id))
+    statement = statement.on_conflict_do_update(
+        index_elements=[Cart.user_id, Cart.product_id, Cart.size, Cart.sugar_level, Cart.ice_place],
+        set_={'quantity': Cart.quantity + statement.excluded.quantity,
+              'total_price': Cart.total_price + statement.excluded.total_price})
+    added = db.session.execute(statement).rowcount
+    if added:
+        sync_cart_summaries([user_id])
+    db.session.commit()
+    return bool(added)
+
+
+def remove_products_from_carts(product_ids):
+    # Runs before products are deleted, so nobody can check out a product that no longer exists
+    removed = db.and_(Cart.user_id == CartSummary.user_id, Cart.product_id.in_(product_ids))
+    db.session.execute(
+        db.update(CartSummary)
+        .where(CartSummary.user_id.in_(db.select(Cart.user_id).where(Cart.product_id.in_(product_ids))))
+        .values(item_count=CartSummary.item_count - db.select(func.count(Cart.id)).where(removed).scalar_subquery(),
+                total_value=CartSummary.total_value - db.select(func.sum(Cart.total_price)).where(removed).scalar_subquery())
+        .execution_options(synchronize_session=False))
+    Cart.query.filter(Cart.product_id.in_(product_ids)).delete(synchronize_session=False)
+
+
+@bp.route("/cart/add", methods=["POST"])
+def add_to_cart():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        product_id = request.form['id']
+        size = request.form['size']
+        sugar_level = request.form['sugar_level']
+        ice_place = request.form['ice_place']
+        quantity = int(request.form['quantity'])
+        product = get_catalog().products.get(int(product_id))
+        if product is None:
+            abort(404)
+
+        size_prices = {
+            'M': 0,
+            'L': 5
+        }
+        total_price = (product.price + size_prices.get(size, 0)) * quantity
+
+        if not add_cart_line(user_id, product.id, size, sugar_level, ice_place, quantity, total_price):
+            abort(404)
+        session['cart'] = get_cart_summary(user_id).item_count
+
+        flash(f'Thêm vào giỏ hàng thành công!', 'success')
+        return redirect(url_for('storefront.product_details', productid=product_id))
+
+    else:
+        flash('Bạn chưa đăng nhập!', 'info')
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route("/cart/")
+@bp.route("/cart")
+def view_cart():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+
+        # Lấy tất cả các mục giỏ hàng cho người dùng hiện tại
+        cart_items = Cart.query.filter_by(user_id=user_id).all()
+
+        # Tính tổng giá trị giỏ hàng
+        total_cart_value = sum(item.total_price for item in cart_items)
+
+        rows = len(cart_items)
+        session['cart'] = rows
+
+        return render_template('/user/cart.html', rows=rows, carts=cart_items, total_cart_value=total_cart_value)
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/update_cart', methods=['POST'])
+def update_cart():
+    user_id = session['current_user']['id']
+    summary = get_cart_summary(user_id)
+    cart_items = Cart.query.filter_by(user_id=user_id).all()
+    removed = [cart_item for cart_item in cart_items if f'delete-{cart_item.id}' in request.form]
+
+    for cart_item in removed:
+        db.session.delete(cart_item)
+    update_cart_summary(summary, item_delta=-len(removed), value_delta=-sum(item.total_price for item in removed))
+
+    db.session.commit()
+    session['cart'] = summary.item_count
+    return redirect(url_for('.view_cart'))
+
+
+@bp.route('/thanhtoan')
+def checkout():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        cart_items = Cart.query.filter_by(user_id=user_id).all()
+        if cart_items:
+            total_cart_value = sum(item.total_price for item in cart_items)
+            rows = len(cart_items)
+            user_info = User.query.filter_by(id=user_id).first()
+            # Identifies this checkout so a double-submitted form only places one order
+            idempotency_key = session.get('checkout_key')
+            if not idempotency_key or Order.query.filter_by(idempotency_key=idempotency_key).first():
+                idempotency_key = session['checkout_key'] = uuid.uuid4().hex
+            return render_template('/user/thanhtoan.html', cart_items=cart_items, total_cart_value=total_cart_value, rows=rows, user_info=user_info, idempotency_key=idempotency_key)
+        else:
+            return redirect(url_for('.view_cart'))
+    else:
+        return redirect(url_for('storefront.login'))
+
+
+@bp.route('/submit_order', methods=['POST'])
+def submit_order():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        name = request.form.get('name')
+        phone_number = request.form.get('number')
+        address = f"{request.form.get('dinoselect')} - {request.form.get('dinoselect2')} - {request.form.get('dinoselect3')} - {request.form.get('address')}"
+        message = request.form.get('message')
+        payment_method = request.form.get('dinoselect5')
+
+        idempotency_key = request.form.get('idempotency_key') or session.get('checkout_key')
+        summary = get_cart_summary(user_id)
+
+        # Order, items and the emptied cart are written in a single transaction
+        cart_total = db.select(func.coalesce(func.sum(Cart.total_price), 0)).where(Cart.user_id == user_id)
+        order = Order(user_id=user_id, name=name, phone_number=phone_number, address=address, message=message,
+                      payment_method=payment_method, total_price=cart_total.scalar_subquery(), status_id=1,
+                      idempotency_key=idempotency_key)
+        db.session.add(order)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            if idempotency_key and Order.query.filter_by(idempotency_key=idempotency_key, user_id=user_id).first():
+                # The first submission of this form already placed the order
+                session.pop('checkout_key', None)
+                return render_template('/user/thanhcong.html')
+            raise
+
+        copied = db.session.execute(db.insert(OrderItem).from_select(
+            ['order_id', 'product_id', 'product_name', 'quantity', 'total_price', 'feature'],
+            db.select(db.literal(order.id), Cart.product_id, Cart.name, Cart.quantity, Cart.total_price,
+                      Cart.size + ' - ' + Cart.sugar_level + ' - ' + Cart.ice_place).where(Cart.user_id == user_id)))
+        if not copied.rowcount:
+            db.session.rollback()
+            return redirect(url_for('.view_cart'))
+
+        # Clear the user's cart after the order is submitted
+        Cart.query.filter_by(user_id=user_id).delete()
+        summary.item_count = 0
+        summary.total_value = 0
+        record_revenue(order.order_date.date(), order_count=1, revenue=order.total_price)
+        db.session.commit()
+        session.pop('checkout_key', None)
+        session['cart'] = 0
+        return render_template('/user/thanhcong.html')
+
+    return render_template('/user/login.html')
+
+
+@click.command('reconcile-carts')
+@click.option('--fix', is_flag=True, help='Overwrite cart summaries that disagree with the cart table.')
+@with_appcontext
+def reconcile_carts_command(fix):
+    totals = _cart_totals()
+    summaries = {summary.user_id: summary for summary in CartSummary.query}
+    mismatched = 0
+    for user_id in totals.keys() | summaries.keys():
+        item_count, total_value = totals.get(user_id, (0, 0))
+        summary = summaries.get(user_id)
+        if summary and summary.item_count == item_count and abs(summary.total_value - total_value) < 0.01:
+            continue
+        mismatched += 1
+        print(f'user {user_id}: summary {(summary.item_count, summary.total_value) if summary else None}, '
+              f'cart {(item_count, total_value)}')
+        if fix:
+            if summary is None:
+                summary = CartSummary(user_id=user_id)
+                db.session.add(summary)
+            summary.item_count = item_count
+            summary.total_value = total_value
+    if fix:
+        db.session.commit()
+    print(f'{mismatched} mismatched cart summaries' + (' fixed' if fix and mismatched else ''))
@@ -0,0 +1,259 @@
+from datetime import datetime, timezone
+from collections import OrderedDict
+import functools
+import gc
+import hashlib
+import os
+import threading
+import time
+import uuid
+from flask import current_app, request, session, make_response
+
+from shop.jobs import enqueue_jobs
+from shop.models import Product, ProductType, db
+
+
+def _version_file(name):
+    return os.path.join(current_app.instance_path, name)
+
+
+def _version(name):
+    # The file's mtime is the version: one stat() per request, shared by every worker process
+    try:
+        return os.stat(_version_file(name)).st_mtime_ns
+    except FileNotFoundError:
+        _bump_version(name)
+        return os.stat(_version_file(name)).st_mtime_ns
+
+
+def _bump_version(name):
+    path = _version_file(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        previous = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        open(path, 'a').close()
+        previous = 0
+    # Never reuse a version, even if the clock is coarse or goes backwards
+    os.utime(path, ns=(time.time_ns(), max(time.time_ns(), previous + 1)))
+
+
+def catalog_version():
+    return _version('catalog_version')
+
+
+def bump_catalog_version():
+    _bump_version('catalog_version')
+
+
+def best_sellers_version():
+    return _version('best_sellers_version')
+
+
+def bump_best_sellers_version():
+    _bump_version('best_sellers_version')
+
+
+class PageCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = OrderedDict()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.pages.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.pages.move_to_end(key)
+            return entry[1:]
+
+    def set(self, key, version, html):
+        # (html, etag, rendered at)
+        entry = (html, hashlib.sha1(html.encode()).hexdigest(), datetime.now(timezone.utc))
+        with self.lock:
+            self.pages[key] = (version,) + entry
+            self.pages.move_to_end(key)
+            while len(self.pages) > current_app.config['PAGE_CACHE_SIZE']:
+                self.pages.popitem(last=False)
+        return entry
+
+
+page_cache = PageCache()
+
+
+def cached_page(view):
+    # Rendered HTML for anonymous visitors, keyed by path and query args and tied to the catalog snapshot
+    # it was rendered from: catalog edits replace the snapshot straight away, sell counts once it expires.
+    # Logged-in pages carry the user's name and cart, so they are always rendered fresh.
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if 'current_user' in session or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        catalog = get_catalog()
+        version = (catalog.version, catalog.built_at)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))))
+        entry = page_cache.get(key, version)
+        if entry is None:
+            html = view(*args, **kwargs)
+            if not isinstance(html, str):
+                return html
+            entry = page_cache.set(key, version, html)
+
+        html, etag, rendered_at = entry
+        response = make_response(html)
+        response.set_etag(etag)
+        response.last_modified = rendered_at
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['PAGE_CACHE_MAX_AGE']
+        return response.make_conditional(request)
+    return wrapper
+
+
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is read-only')
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}>'
+
+
+class ProductTypeRecord(_Record):
+    __slots__ = ('id', 'name', 'picture')
+
+
+class ProductRecord(_Record):
+    __slots__ = ('id', 'name', 'model', 'picture', 'price', 'sell_count', 'date_added', 'product_type')
+
+
+BEST_SELLERS_LIMIT = 5
+# Admin edits bump the catalog version and are seen at once. Sell counts change with every delivered order
+# and are only picked up when the snapshot is this old, as are rows changed behind the app's back; the best
+# sellers have a version of their own and are re-read as soon as delivered orders are counted.
+CATALOG_SNAPSHOT_TTL = 300
+# Every (sort_order, sort_by) the product listing accepts
+CATALOG_ORDERINGS = [(sort_order, sort_by) for sort_order in ('', 'asc', 'desc') for sort_by in ('', 'times', 'date')]
+
+
+def _listing_key(sort_order, sort_by):
+    # Price first when asked for, then sales or date, as the listing's ORDER BY did. Ties go to the
+    # lower id, and products without a sell count come last like NULLs do in a descending SQL sort.
+    def key(product):
+        if sort_by == 'times':
+            then = (product.sell_count is None, -(product.sell_count or 0), product.id)
+        elif sort_by == 'date':
+            then = (datetime.max - product.date_added, product.id)
+        else:
+            then = (product.id,)
+        if sort_order == 'asc':
+            return (product.price,) + then
+        if sort_order == 'desc':
+            return (-product.price,) + then
+        return then
+    return key
+
+
+class CatalogSnapshot:
+    # Built once per catalog version and never changed afterwards: requests that picked up a snapshot
+    # keep a consistent view, and a newer version simply replaces the module-level reference
+    __slots__ = ('version', 'built_at', 'types', 'products', 'listings')
+
+    def __init__(self, version):
+        self.version = version
+        self.built_at = time.monotonic()
+        self.types = {row.id: ProductTypeRecord(**row._asdict()) for row in db.session.execute(
+            db.select(ProductType.id, ProductType.name, ProductType.picture).order_by(ProductType.id))}
+        self.products = {row.id: ProductRecord(product_type=self.types.get(row.model), **row._asdict())
+                         for row in db.session.execute(db.select(*Product.__table__.columns).order_by(Product.id))}
+        db.session.rollback()
+
+        by_type = {None: list(self.products.values())}
+        for product in self.products.values():
+            by_type.setdefault(product.model, []).append(product)
+        # (type id or None for everything, ordering) -> tuple of products
+        self.listings = {(type_id, ordering): tuple(sorted(products, key=_listing_key(*ordering)))
+                         for type_id, products in by_type.items() for ordering in CATALOG_ORDERINGS}
+
+    def listing(self, type_id=None, sort_order='', sort_by=''):
+        ordering = (sort_order if sort_order in ('asc', 'desc') else '', sort_by if sort_by in ('times', 'date') else '')
+        return self.listings.get((type_id, ordering), ())
+
+
+_catalog_snapshot = None
+_catalog_snapshot_lock = threading.Lock()
+
+
+def get_catalog():
+    version = catalog_version()
+    snapshot = _catalog_snapshot
+    if snapshot is None or snapshot.version != version or \
+            time.monotonic() - snapshot.built_at > CATALOG_SNAPSHOT_TTL:
+        snapshot = _build_catalog(version)
+    return snapshot
+
+
+def _build_catalog(version):
+    global _catalog_snapshot
+    with _catalog_snapshot_lock:
+        # Another thread may have built it while we waited
+        snapshot = _catalog_snapshot
+        if snapshot is None or snapshot.version != version or \
+                time.monotonic() - snapshot.built_at > CATALOG_SNAPSHOT_TTL:
+            snapshot = _catalog_snapshot = CatalogSnapshot(version)
+        return snapshot
+
+
+_best_sellers = (None, ())
+
+
+def get_best_sellers():
+    # A few rows read again whenever delivered orders are counted, instead of the whole snapshot
+    global _best_sellers
+    catalog = get_catalog()
+    version = (catalog.version, catalog.built_at, best_sellers_version())
+    loaded_version, products = _best_sellers
+    if loaded_version != version:
+        rows = db.session.execute(db.select(*Product.__table__.columns).order_by(
+            Product.sell_count.is_(None), Product.sell_count.desc(), Product.id).limit(BEST_SELLERS_LIMIT))
+        products = tuple(ProductRecord(product_type=catalog.types.get(row.model), **row._asdict()) for row in rows)
+        db.session.rollback()
+        _best_sellers = (version, products)
+    return list(products)
+
+
+def warm_catalog(app):
+    # Called from gunicorn.conf.py in the master process before any worker is forked. Workers start out with
+    # the app and this snapshot shared copy-on-write, frozen so the garbage collector leaves their pages alone.
+    # Each worker replaces the snapshot with a private one on the next admin edit or after CATALOG_SNAPSHOT_TTL
+    with app.app_context():
+        get_catalog()
+    gc.freeze()
+
+
+def get_product_types():
+    return list(get_catalog().types.values())
+
+
+def get_product_type_name(product_type_id):
+    try:
+        product_type = get_catalog().types.get(int(product_type_id))
+    except (TypeError, ValueError):
+        product_type = None
+    return product_type.name if product_type else None
+
+
+def catalog_changed(changed_ids=(), deleted_ids=()):
+    bump_catalog_version()
+    # Refitting the name index loads scikit-learn, so it runs on the job worker instead of in the admin's request
+    enqueue_jobs('refresh_similarity', {f'refresh_similarity:{uuid.uuid4().hex}': {
+        'changed_ids': list(changed_ids), 'deleted_ids': list(deleted_ids)}})
+    db.session.commit()
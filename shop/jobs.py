@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from shop.models import Job, db, dialect_insert
+
+
+JOB_HANDLERS = {}
+# Kinds the job thread inside the web workers runs; the others wait for `flask run-jobs`
+WEB_JOB_KINDS = set()
+# Kinds whose handler takes the payloads of every due job of that kind at once, run in one transaction
+BATCHED_JOB_KINDS = set()
+JOB_BATCH_SIZE = 100
+
+
+def job_handler(kind, in_web_workers=True, batched=False):
+    def register(function):
+        JOB_HANDLERS[kind] = function
+        if in_web_workers:
+            WEB_JOB_KINDS.add(kind)
+        if batched:
+            BATCHED_JOB_KINDS.add(kind)
+        return function
+    return register
+
+
+def enqueue_jobs(kind, jobs):
+    # Runs in the caller's transaction, so a job exists exactly when the change that caused it was committed
+    now = datetime.utcnow()
+    rows = [{'kind': kind, 'payload': json.dumps(payload), 'idempotency_key': key, 'status': 'pending',
+             'attempts': 0, 'run_after': now, 'created_at': now} for key, payload in jobs.items()]
+    if rows:
+        db.session.execute(dialect_insert(Job).values(rows).on_conflict_do_nothing(
+            index_elements=[Job.idempotency_key]))
+
+
+def run_pending_jobs(limit=JOB_BATCH_SIZE, kinds=None):
+    query = db.select(Job.id, Job.kind, Job.payload, Job.attempts)\
+        .where(Job.status == 'pending', Job.run_after <= datetime.utcnow())
+    if kinds is not None:
+        query = query.where(Job.kind.in_(kinds))
+    due = db.session.execute(query.order_by(Job.id).limit(limit)).all()
+    db.session.rollback()
+    groups, batches = [], {}
+    for job in due:
+        if job.kind not in BATCHED_JOB_KINDS:
+            groups.append([job])
+        elif job.kind in batches:
+            batches[job.kind].append(job)
+        else:
+            batches[job.kind] = [job]
+            groups.append(batches[job.kind])
+    return sum(_run_jobs(jobs) for jobs in groups)
+
+
+def _run_jobs(jobs):
+    try:
+        # Claiming the jobs and their side effects commit together: a job that ran can't run again,
+        # and one that failed half way leaves nothing behind
+        claimed = set(db.session.execute(
+            db.update(Job).where(Job.id.in_([job.id for job in jobs]), Job.status == 'pending')
+            .values(status='done', attempts=Job.attempts + 1, finished_at=datetime.utcnow())
+            .returning(Job.id)
+            .execution_options(synchronize_session=False)).scalars())
+        # Another worker may have got to some of them first
+        jobs = [job for job in jobs if job.id in claimed]
+        if not jobs:
+            db.session.rollback()
+            return 0
+        payloads = [json.loads(job.payload) for job in jobs]
+        JOB_HANDLERS[jobs[0].kind](payloads if jobs[0].kind in BATCHED_JOB_KINDS else payloads[0])
+        db.session.commit()
+        return len(jobs)
+    except Exception as exc:
+        db.session.rollback()
+        if len(jobs) > 1:
+            # One bad job fails the whole batch: run them one at a time so only that one is retried
+            return sum(_run_jobs([job]) for job in jobs)
+        job = jobs[0]
+        current_app.logger.exception('Job %s (%s) failed', job.id, job.kind)
+        attempts = job.attempts + 1
+        retry_delay = timedelta(seconds=current_app.config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1))
+        db.session.execute(
+            db.update(Job).where(Job.id == job.id, Job.status == 'pending')
+            .values(attempts=attempts, last_error=str(exc)[:1000],
+                    status='failed' if attempts >= current_app.config['JOB_MAX_ATTEMPTS'] else 'pending',
+                    run_after=datetime.utcnow() + retry_delay)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return 0
+
+
+class JobWorker:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def start(self, app):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, args=(app,), name='jobs', daemon=True)
+                self.worker.start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(app.config['JOB_POLL_INTERVAL'])
+            with app.app_context():
+                try:
+                    run_pending_jobs(kinds=WEB_JOB_KINDS)
+                except Exception:
+                    current_app.logger.exception('Running background jobs failed')
+
+
+job_worker = JobWorker()
+os.register_at_fork(after_in_child=job_worker.reset)
+
+
+def start_job_worker():
+    # Each worker process starts polling on its first request, so jobs queued before a restart or
+    # waiting for a retry are run even if this worker never queues anything itself
+    if job_worker.worker is None:
+        job_worker.start(current_app._get_current_object())
+
+
+@click.command('run-jobs')
+@click.option('--retry-failed', is_flag=True, help='Give jobs that ran out of attempts another go')
+@click.option('--watch', is_flag=True, help='Keep polling for new jobs instead of stopping when none are due')
+@with_appcontext
+def run_jobs_command(retry_failed, watch):
+    if retry_failed:
+        db.session.execute(db.update(Job).where(Job.status == 'failed')
+                           .values(status='pending', attempts=0, run_after=datetime.utcnow()))
+        db.session.commit()
+    ran = 0
+    while True:
+        batch = run_pending_jobs()
+        if not batch:
+            if not watch:
+                break
+            time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+        ran += batch
+    pending = Job.query.filter_by(status='pending').count()
+    failed = Job.query.filter_by(status='failed').count()
+    print(f'Ran {ran} jobs; {pending} waiting to be retried, {failed} failed for good (see --retry-failed)')
@@ -0,0 +1,144 @@
+from collections import Counter
+import cProfile
+import os
+import re
+import threading
+import time
+from flask import current_app, request, Response, abort, g, has_app_context, before_render_template, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+REQUEST_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_SQL_PARAMETERS = re.compile(r'\((?:\?|%\(\w+\)s|%s)(?:, (?:\?|%\(\w+\)s|%s))*\)')
+
+
+# Process-wide counters other modules add to /metrics: name -> function returning the current value
+COUNTERS = {}
+
+
+class RouteMetrics:
+    # Totals for this worker process since it started, per endpoint
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, endpoint, seconds, stats, n_plus_one):
+        with self.lock:
+            route = self.routes.get(endpoint)
+            if route is None:
+                route = self.routes[endpoint] = {'buckets': [0] * len(REQUEST_SECONDS_BUCKETS), 'count': 0,
+                                                 'seconds': 0.0, 'render_seconds': 0.0, 'sql_count': 0,
+                                                 'sql_seconds': 0.0, 'n_plus_one': 0}
+            for i, bound in enumerate(REQUEST_SECONDS_BUCKETS):
+                if seconds <= bound:
+                    route['buckets'][i] += 1
+            route['count'] += 1
+            route['seconds'] += seconds
+            route['render_seconds'] += stats['render_seconds']
+            route['sql_count'] += stats['sql_count']
+            route['sql_seconds'] += stats['sql_seconds']
+            route['n_plus_one'] += n_plus_one
+
+    def render(self):
+        with self.lock:
+            routes = {endpoint: dict(route, buckets=list(route['buckets'])) for endpoint, route in self.routes.items()}
+        lines = ['# TYPE shop_request_seconds histogram']
+        for endpoint, route in sorted(routes.items()):
+            for bound, count in zip(REQUEST_SECONDS_BUCKETS, route['buckets']):
+                lines.append(f'shop_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+            lines.append(f'shop_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {route["count"]}')
+            lines.append(f'shop_request_seconds_sum{{endpoint="{endpoint}"}} {route["seconds"]}')
+            lines.append(f'shop_request_seconds_count{{endpoint="{endpoint}"}} {route["count"]}')
+        for name, key in [('shop_render_seconds_total', 'render_seconds'), ('shop_sql_queries_total', 'sql_count'),
+                          ('shop_sql_seconds_total', 'sql_seconds'), ('shop_n_plus_one_total', 'n_plus_one')]:
+            lines.append(f'# TYPE {name} counter')
+            lines.extend(f'{name}{{endpoint="{endpoint}"}} {route[key]}' for endpoint, route in sorted(routes.items()))
+        for name, value in COUNTERS.items():
+            lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name} {value()}')
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+
+def _request_stats():
+    # Only requests being instrumented have stats; background flushes and CLI commands don't
+    return g.get('request_stats') if has_app_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    if _request_stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats()
+    if stats is not None and conn.info.get('query_started'):
+        stats['sql_seconds'] += time.perf_counter() - conn.info['query_started'].pop()
+        stats['sql_count'] += 1
+        stats['statements'][_SQL_PARAMETERS.sub('(?)', ' '.join(statement.split()))] += 1
+
+
+def _render_started(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None:
+        stats['render_started'] = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    stats = _request_stats()
+    if stats is not None and 'render_started' in stats:
+        stats['render_seconds'] += time.perf_counter() - stats.pop('render_started')
+
+
+def start_instrumentation():
+    if not current_app.config['INSTRUMENTATION']:
+        return
+    g.request_stats = {'started': time.perf_counter(), 'render_seconds': 0.0, 'sql_count': 0, 'sql_seconds': 0.0,
+                       'statements': Counter()}
+    if current_app.config['PROFILE_DIR']:
+        g.request_stats['profiler'] = cProfile.Profile()
+        g.request_stats['profiler'].enable()
+
+
+def finish_instrumentation(response):
+    stats = g.pop('request_stats', None)
+    if stats is None:
+        return response
+    seconds = time.perf_counter() - stats['started']
+    endpoint = request.endpoint or 'unmatched'
+
+    n_plus_one = 0
+    for statement, count in stats['statements'].items():
+        if count > current_app.config['N_PLUS_ONE_THRESHOLD']:
+            n_plus_one += 1
+            current_app.logger.warning('Possible N+1 in %s: %d x %s', endpoint, count, statement[:200])
+    route_metrics.record(endpoint, seconds, stats, n_plus_one)
+    response.headers['Server-Timing'] = (f'app;dur={seconds * 1000:.1f}, sql;dur={stats["sql_seconds"] * 1000:.1f}, '
+                                         f'render;dur={stats["render_seconds"] * 1000:.1f}')
+
+    if 'profiler' in stats:
+        stats['profiler'].disable()
+        os.makedirs(current_app.config['PROFILE_DIR'], exist_ok=True)
+        stats['profiler'].dump_stats(os.path.join(current_app.config['PROFILE_DIR'], f'{endpoint}-{time.time_ns()}.prof'))
+    return response
+
+
+def metrics():
+    if not current_app.config['INSTRUMENTATION']:
+        abort(404)
+    return Response(route_metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.before_request(start_instrumentation)
+    app.after_request(finish_instrumentation)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics)
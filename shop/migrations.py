@@ -0,0 +1,223 @@
+from sqlalchemy import func
+from sqlalchemy.schema import AddConstraint
+
+from shop.cart import sync_cart_summaries
+from shop.models import Cart, CartSummary, Job, Order, OrderItem, Product, ProductAffinity, ProductView, SchemaVersion, User, db
+from shop.orders import rebuild_revenue_rollup
+import click
+from flask.cli import with_appcontext
+
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(function):
+        MIGRATIONS.append((version, description, function))
+        return function
+    return register
+
+
+def _add_missing_columns(connection, table):
+    preparer = connection.dialect.identifier_preparer
+    existing = {column['name'] for column in db.inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            connection.execute(db.text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN '
+                                       f'{preparer.format_column(column)} {column.type.compile(connection.dialect)}'))
+
+
+def _create_missing_indexes(connection, table):
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _rebuild_sqlite_table(connection, table):
+    # SQLite can't add constraints to an existing table: copy the rows into a fresh one built from the model
+    existing = [column['name'] for column in db.inspect(connection).get_columns(table.name)]
+    columns = ', '.join(f'"{column.name}"' for column in table.columns if column.name in existing)
+    indexes = connection.execute(db.text("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = :table "
+                                         "AND sql IS NOT NULL"), {'table': table.name}).scalars().all()
+    rebuilt = table.to_metadata(db.metadata, name=f'{table.name}_rebuilt')
+    rebuilt.indexes.clear()
+    try:
+        rebuilt.create(connection)
+        connection.execute(db.text(f'INSERT INTO "{rebuilt.name}" ({columns}) SELECT {columns} FROM "{table.name}"'))
+        connection.execute(db.text(f'DROP TABLE "{table.name}"'))
+        connection.execute(db.text(f'ALTER TABLE "{rebuilt.name}" RENAME TO "{table.name}"'))
+    finally:
+        db.metadata.remove(rebuilt)
+    # Put back the indexes the table had; later migrations add the newer ones
+    for index in indexes:
+        connection.execute(db.text(index))
+
+
+def _add_missing_foreign_keys(connection, table):
+    existing = {tuple(foreign_key['constrained_columns'])
+                for foreign_key in db.inspect(connection).get_foreign_keys(table.name)}
+    missing = [constraint for constraint in table.foreign_key_constraints
+               if tuple(constraint.column_keys) not in existing]
+    if not missing:
+        return
+    if connection.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(connection, table)
+    else:
+        for constraint in missing:
+            connection.execute(AddConstraint(constraint))
+
+
+def _replace_foreign_keys(connection, table):
+    # Unlike _add_missing_foreign_keys this also picks up a changed ON DELETE rule
+    if connection.dialect.name == 'sqlite':
+        _rebuild_sqlite_table(connection, table)
+        return
+    preparer = connection.dialect.identifier_preparer
+    for foreign_key in db.inspect(connection).get_foreign_keys(table.name):
+        connection.execute(db.text(f'ALTER TABLE {preparer.format_table(table)} '
+                                   f'DROP CONSTRAINT {preparer.quote(foreign_key["name"])}'))
+    for constraint in table.foreign_key_constraints:
+        connection.execute(AddConstraint(constraint))
+
+
+@migration(1, 'Create tables added since the original schema')
+def _create_tables(connection):
+    db.metadata.create_all(connection)
+
+
+@migration(2, 'Add order.idempotency_key')
+def _add_order_columns(connection):
+    _add_missing_columns(connection, Order.__table__)
+
+
+@migration(3, 'Index product sort columns, order dates and foreign key columns')
+def _add_indexes(connection):
+    for model in (Product, Order, OrderItem):
+        _create_missing_indexes(connection, model.__table__)
+    connection.execute(db.text('CREATE INDEX IF NOT EXISTS ix_cart_user_id ON cart (user_id)'))
+
+
+@migration(4, 'Add foreign keys on cart.product_id and product_view')
+def _add_foreign_keys(connection):
+    for model in (Cart, ProductView):
+        _add_missing_foreign_keys(connection, model.__table__)
+
+
+@migration(5, 'Merge duplicate cart lines and make (user, product, options) unique')
+def _add_cart_line_index(connection):
+    line = 'user_id, product_id, size, sugar_level, ice_place'
+    same_line = ' AND '.join(f'duplicate.{column} = cart.{column}' for column in line.split(', '))
+    connection.execute(db.text(f'''UPDATE cart SET
+        quantity = (SELECT SUM(quantity) FROM cart AS duplicate WHERE {same_line}),
+        total_price = (SELECT SUM(total_price) FROM cart AS duplicate WHERE {same_line})
+        WHERE id IN (SELECT MIN(id) FROM cart GROUP BY {line} HAVING COUNT(*) > 1)'''))
+    connection.execute(db.text(f'DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY {line})'))
+    connection.execute(db.text('DROP INDEX IF EXISTS ix_cart_user_id'))
+    _create_missing_indexes(connection, Cart.__table__)
+    sync_cart_summaries(connection=connection)
+
+
+@migration(6, 'Index product views by user and time')
+def _add_product_view_index(connection):
+    _create_missing_indexes(connection, ProductView.__table__)
+
+
+@migration(7, 'Add product_affinity for co-purchase and co-view recommendations')
+def _create_product_affinity(connection):
+    ProductAffinity.__table__.create(connection, checkfirst=True)
+
+
+@migration(8, 'Widen user.password to fit scrypt hashes')
+def _widen_password_column(connection):
+    # SQLite doesn't enforce VARCHAR lengths
+    if connection.dialect.name != 'sqlite':
+        connection.execute(db.text('ALTER TABLE "user" ALTER COLUMN password TYPE VARCHAR(255)'))
+
+
+@migration(9, 'Add the background job queue')
+def _create_job_table(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+
+@migration(10, 'Index orders by user, status and date')
+def _add_order_history_index(connection):
+    _create_missing_indexes(connection, Order.__table__)
+    # The new index starts with user_id, so the old one on user_id alone only slows down writes
+    connection.execute(db.text('DROP INDEX IF EXISTS ix_order_user_id'))
+
+
+@migration(11, 'Backfill the daily revenue rollup from existing orders')
+def _backfill_revenue_rollup(connection):
+    # Checkout adds to the rollup from the first order after the upgrade, so the orders placed before it
+    # have to be in there before the app serves anything
+    rebuild_revenue_rollup(connection)
+
+
+@migration(12, 'Drop cart lines whose product no longer exists')
+def _drop_orphaned_cart_lines(connection):
+    # Left behind when a worker's buffered cart additions were written after the product was deleted
+    connection.execute(db.delete(Cart).where(Cart.product_id.not_in(db.select(Product.id))))
+    sync_cart_summaries(connection=connection)
+
+
+@migration(13, 'Delete cart lines and cart summaries together with their user')
+def _cascade_cart_user_deletes(connection):
+    # Rows left behind by users deleted while SQLite wasn't enforcing foreign keys
+    for model in (Cart, CartSummary):
+        connection.execute(db.delete(model).where(model.user_id.not_in(db.select(User.id))))
+        _replace_foreign_keys(connection, model.__table__)
+
+
+def get_schema_version(connection):
+    if not db.inspect(connection).has_table(SchemaVersion.__tablename__):
+        return None
+    return connection.execute(db.select(func.max(SchemaVersion.version))).scalar() or 0
+
+
+def upgrade_db():
+    with db.engine.begin() as connection:
+        current = get_schema_version(connection)
+        if current is None:
+            if db.inspect(connection).has_table(User.__tablename__):
+                # Database from before versioned migrations
+                SchemaVersion.__table__.create(connection)
+                current = 0
+            else:
+                # Empty database: the models already describe the latest schema
+                db.metadata.create_all(connection)
+                connection.execute(db.insert(SchemaVersion), [
+                    {'version': version, 'description': description} for version, description, _ in MIGRATIONS])
+                return
+
+    for version, description, function in sorted(MIGRATIONS, key=lambda item: item[0]):
+        if version <= current:
+            continue
+        # One transaction per migration, so a failure leaves the database at the previous version
+        with db.engine.connect() as connection:
+            foreign_keys = _set_sqlite_foreign_keys(connection, 0)
+            try:
+                with connection.begin():
+                    function(connection)
+                    connection.execute(db.insert(SchemaVersion).values(version=version, description=description))
+            finally:
+                _set_sqlite_foreign_keys(connection, foreign_keys)
+        print(f'Applied migration {version}: {description}')
+
+
+def _set_sqlite_foreign_keys(connection, enabled):
+    # SQLite rebuilds tables by copying their rows, which older databases can't do with foreign keys
+    # enforced: they still hold rows whose product or user was deleted before SQLite checked.
+    # The pragma is ignored inside a transaction, so it is set and committed on its own
+    if connection.dialect.name != 'sqlite':
+        return None
+    previous = connection.exec_driver_sql('PRAGMA foreign_keys').scalar()
+    connection.exec_driver_sql(f'PRAGMA foreign_keys = {int(enabled)}')
+    connection.commit()
+    return previous
+
+
+@click.command('upgrade-db')
+@with_appcontext
+def upgrade_db_command():
+    upgrade_db()
+    with db.engine.connect() as connection:
+        print(f'Database schema is at version {get_schema_version(connection)}')
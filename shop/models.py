@@ -0,0 +1,222 @@
+from datetime import datetime
+import functools
+from flask import current_app, session
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.security import generate_password_hash, check_password_hash
+
+db = SQLAlchemy()
+
+
+def set_sqlite_pragmas(config, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def dialect_insert(model):
+    # INSERT ... ON CONFLICT is spelled the same way on both backends but lives in dialect modules
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+@functools.lru_cache
+def _password_hash_prefix(method):
+    # Werkzeug stores the method with its defaults filled in ('scrypt' becomes 'scrypt:32768:8:1'),
+    # so compare against what a hash made with this method actually starts with
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    phone_number = db.Column(db.String(10), unique=True, nullable=False)
+    password = db.Column(db.String(255))
+    role = db.Column(db.String(50), default='user', nullable=False)
+
+    def __init__(self, name, email, phone_number, password):
+        self.name = name
+        self.email = email
+        self.phone_number = phone_number
+        self.set_password(password)
+
+    def set_password(self, password):
+        self.password = generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+    def check_password(self, password):
+        return check_password_hash(self.password, password)
+
+    def needs_rehash(self):
+        return self.password.split('$', 1)[0] != _password_hash_prefix(current_app.config['PASSWORD_HASH_METHOD'])
+
+    def update_profile(self, name, email, phone_number):
+        self.name = name
+        self.email = email
+        self.phone_number = phone_number
+        db.session.commit()
+
+        session['current_user']['name'] = name
+
+
+class Contact(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    phone_number = db.Column(db.String(10), nullable=False)
+    city = db.Column(db.String(50))
+    shop = db.Column(db.String(100))
+    title = db.Column(db.String(100), nullable=False)
+    message = db.Column(db.String(1000), nullable=False)
+
+    def __init__(self, name, phone_number, city, shop, title, message):
+        self.name = name
+        self.phone_number = phone_number
+        self.city = city
+        self.shop = shop
+        self.title = title
+        self.message = message
+
+
+class ProductType(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(300), nullable=False)
+    picture = db.Column(db.String(400), nullable=False)
+    products = db.relationship('Product', backref='product_type')
+
+    def delete(self):
+        for product in self.products:
+            db.session.delete(product)
+
+        db.session.delete(self)
+        db.session.commit()
+
+    def update(self, name, picture):
+        self.name = name
+        self.picture = picture
+        db.session.commit()
+
+
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(300), nullable=False)
+    model = db.Column(db.Integer, db.ForeignKey('product_type.id'), nullable=False, index=True)
+    picture = db.Column(db.String(400), nullable=False)
+    price = db.Column(db.Integer, nullable=False, index=True)
+    sell_count = db.Column(db.Integer, index=True)
+    date_added = db.Column(db.DateTime, nullable=False, index=True)
+    order = db.relationship('OrderItem', backref='product')
+
+
+class SchemaVersion(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class ProductSimilarity(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    similar_product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class ProductAffinity(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    related_product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class Cart(db.Model):
+    __table_args__ = (
+        # One row per cart line, so adding to an existing line is a single upsert
+        db.Index('ix_cart_line', 'user_id', 'product_id', 'size', 'sugar_level', 'ice_place', unique=True),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(300), nullable=False)
+    picture = db.Column(db.String(400), nullable=False)
+    size = db.Column(db.String(10), nullable=False)
+    sugar_level = db.Column(db.String(10), nullable=False)
+    ice_place = db.Column(db.String(10), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    date_added = db.Column(db.DateTime, nullable=False)
+
+
+class CartSummary(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_value = db.Column(db.Float, nullable=False, default=0)
+
+
+class Order(db.Model):
+    # Order history: one user's orders, optionally of one status, newest first
+    __table_args__ = (db.Index('ix_order_user_status_date', 'user_id', 'status_id', 'order_date'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    name = db.Column(db.String(120), nullable=False)
+    phone_number = db.Column(db.String(10), nullable=False)
+    address = db.Column(db.String(500), nullable=False)
+    products = db.relationship('OrderItem', backref='order')
+    total_price = db.Column(db.Float, nullable=False)
+    message = db.Column(db.String(300), nullable=True)
+    payment_method = db.Column(db.String(300), nullable=False)
+    order_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    status_id = db.Column(db.Integer, db.ForeignKey('order_status.id'), nullable=False, default=1)
+    idempotency_key = db.Column(db.String(64), nullable=True, unique=True, index=True)
+
+
+class OrderStatus(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status_name = db.Column(db.String(255), nullable=False, unique=True)
+    status = db.relationship('Order', backref='order_status')
+
+
+class OrderItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    product_name = db.Column(db.String(300), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    total_price = db.Column(db.Float, nullable=False)
+    feature = db.Column(db.String(300), nullable=False)
+
+
+class DailyRevenue(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+    cancelled_count = db.Column(db.Integer, nullable=False, default=0)
+    cancelled_revenue = db.Column(db.Float, nullable=False, default=0)
+
+
+class Job(db.Model):
+    __table_args__ = (db.Index('ix_job_pending', 'status', 'run_after'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    # One job per side effect: queueing the same key again is a no-op
+    idempotency_key = db.Column(db.String(100), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class ProductView(db.Model):
+    __table_args__ = (db.Index('ix_product_view_user_time', 'user_id', 'timestamp'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __init__(self, user_id, product_id):
+        self.user_id = user_id
+        self.product_id = product_id
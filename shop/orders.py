@@ -0,0 +1,124 @@
+from datetime import date, timedelta
+import time
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func
+
+from shop.catalog import _Record, bump_best_sellers_version
+from shop.jobs import enqueue_jobs, job_handler
+from shop.models import DailyRevenue, Order, OrderItem, OrderStatus, Product, db, dialect_insert
+
+
+class OrderStatusRecord(_Record):
+    __slots__ = ('id', 'status_name')
+
+
+# Order statuses are fixed lookup rows, re-read at most this often
+ORDER_STATUSES_TTL = 3600
+_order_statuses = (0, ())
+
+
+def get_order_statuses():
+    global _order_statuses
+    loaded_at, statuses = _order_statuses
+    if not statuses or time.monotonic() - loaded_at > ORDER_STATUSES_TTL:
+        statuses = tuple(OrderStatusRecord(**row._asdict()) for row in db.session.execute(
+            db.select(OrderStatus.id, OrderStatus.status_name).order_by(OrderStatus.id)))
+        _order_statuses = (time.monotonic(), statuses)
+    return list(statuses)
+
+
+ORDER_STATUS_JOBS = {2: 'order_delivered', 3: 'order_cancelled'}
+
+
+def enqueue_order_jobs(kind, order_ids):
+    enqueue_jobs(kind, {f'{kind}:{order_id}': {'order_id': order_id} for order_id in order_ids})
+
+
+def filter_orders(query, status=None, date_from=None, date_to=None):
+    if status is not None:
+        query = query.filter(Order.status_id == status)
+    if date_from is not None:
+        query = query.filter(Order.order_date >= date_from)
+    if date_to is not None:
+        query = query.filter(Order.order_date < date_to + timedelta(days=1))
+    return query
+
+
+def apply_sell_counts(order_ids):
+    # One grouped UPDATE for every product in the given orders, summing quantities across orders
+    sold = db.select(func.sum(OrderItem.quantity))\
+        .where(OrderItem.order_id.in_(order_ids), OrderItem.product_id == Product.id)\
+        .scalar_subquery()
+    db.session.execute(
+        db.update(Product)
+        .where(Product.id.in_(db.select(OrderItem.product_id).where(OrderItem.order_id.in_(order_ids))))
+        .values(sell_count=func.coalesce(Product.sell_count, 0) + sold)
+        .execution_options(synchronize_session=False))
+
+
+@job_handler('order_delivered', batched=True)
+def _count_delivered_orders(payloads):
+    # Orders delivered together, e.g. by the bulk action, are counted in one grouped UPDATE.
+    # Only the best sellers are invalidated, once the counts are committed; the rest of the catalog
+    # shows the new counts when its snapshot expires
+    apply_sell_counts([payload['order_id'] for payload in payloads])
+    event.listen(db.session(), 'after_commit', lambda session: bump_best_sellers_version(), once=True)
+
+
+@job_handler('order_cancelled')
+def _record_cancelled_order(payload):
+    order = db.session.get(Order, payload['order_id'])
+    record_revenue(order.order_date.date(), cancelled_count=1, cancelled_revenue=order.total_price)
+
+
+REVENUE_MAX_DAYS = 3660
+
+
+def record_revenue(day, **increments):
+    # Called inside the transaction that places or cancels the order
+    statement = dialect_insert(DailyRevenue).values(day=day, **increments)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DailyRevenue.day],
+        set_={name: getattr(DailyRevenue, name) + statement.excluded[name] for name in increments})
+    db.session.execute(statement)
+
+
+def rebuild_revenue_rollup(connection=None):
+    executor = connection or db.session
+    executor.execute(db.delete(DailyRevenue))
+    day = func.date(Order.order_date)
+    cancelled = Order.status_id == 3  # 'Đã hủy'
+    rows = executor.execute(db.select(day, func.count(Order.id), func.sum(Order.total_price),
+                                      func.sum(db.case((cancelled, 1), else_=0)),
+                                      func.sum(db.case((cancelled, Order.total_price), else_=0))).group_by(day))
+    days = [{'day': day if isinstance(day, date) else date.fromisoformat(day), 'order_count': order_count,
+             'revenue': revenue or 0, 'cancelled_count': cancelled_count, 'cancelled_revenue': cancelled_revenue or 0}
+            for day, order_count, revenue, cancelled_count, cancelled_revenue in rows]
+    if days:
+        executor.execute(db.insert(DailyRevenue), days)
+    if connection is None:
+        db.session.commit()
+
+
+def get_revenue_series(start, end):
+    rows = {row.day: row for row in DailyRevenue.query.filter(DailyRevenue.day.between(start, end))}
+    series = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        row = rows.get(day)
+        series.append({
+            'day': day.isoformat(),
+            'order_count': row.order_count if row else 0,
+            'revenue': row.revenue if row else 0,
+            'cancelled_count': row.cancelled_count if row else 0,
+            'cancelled_revenue': row.cancelled_revenue if row else 0,
+        })
+    return series
+
+
+@click.command('rebuild-revenue')
+@with_appcontext
+def rebuild_revenue_command():
+    rebuild_revenue_rollup()
+    print(f'Rolled up revenue for {DailyRevenue.query.count()} days')
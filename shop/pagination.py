@@ -0,0 +1,20 @@
+from flask import request
+
+
+ADMIN_PAGE_SIZE = 50
+ADMIN_MAX_PAGE_SIZE = 200
+
+
+def get_page_args():
+    cursor = request.args.get('cursor', type=int)
+    limit = min(max(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), 1), ADMIN_MAX_PAGE_SIZE)
+    return cursor, limit
+
+
+def keyset_page(query, key, cursor, limit, newest_first=False):
+    # Seek past the last key of the previous page instead of OFFSET, so every page costs the same
+    if cursor is not None:
+        query = query.filter(key < cursor if newest_first else key > cursor)
+    rows = query.order_by(key.desc() if newest_first else key.asc()).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
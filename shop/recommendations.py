@@ -0,0 +1,330 @@
+from datetime import datetime, timedelta
+import atexit
+import os
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from shop.catalog import get_catalog
+from shop.jobs import enqueue_jobs, job_handler
+from shop.metrics import COUNTERS
+from shop.models import OrderItem, Product, ProductAffinity, ProductSimilarity, ProductView, User, db
+
+
+SIMILAR_PRODUCTS_LIMIT = 4
+# Keep a few more neighbours than we show so incremental refreshes have room to work with
+SIMILARITY_INDEX_SIZE = 10
+
+
+def _fit_product_names():
+    # scikit-learn, scipy and numpy are imported where they are used: together they add over a second and
+    # ~100 MB to every worker, and only index builds need them
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    rows = db.session.query(Product.id, Product.name).order_by(Product.id).all()
+    if not rows:
+        return [], None
+    vectorizer = TfidfVectorizer()
+    try:
+        matrix = vectorizer.fit_transform([row.name for row in rows])
+    except ValueError:
+        # Empty vocabulary, e.g. every name is a single character
+        return [], None
+    return [row.id for row in rows], matrix
+
+
+def _similarity_rows(product_ids, matrix, positions, chunk_size=500):
+    from sklearn.metrics.pairwise import linear_kernel
+
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start:start + chunk_size]
+        scores = linear_kernel(matrix[chunk], matrix)
+        for position, row in zip(chunk, scores):
+            row[position] = -1
+            for i in row.argsort()[:-SIMILARITY_INDEX_SIZE - 1:-1]:
+                if i != position:
+                    yield {'product_id': product_ids[position],
+                           'similar_product_id': product_ids[i],
+                           'score': float(row[i])}
+
+
+def _write_similarity_rows(product_ids, rows):
+    db.session.execute(db.delete(ProductSimilarity).where(ProductSimilarity.product_id.in_(product_ids)))
+    rows = list(rows)
+    if rows:
+        db.session.execute(db.insert(ProductSimilarity), rows)
+
+
+def rebuild_similarity_index():
+    db.session.execute(db.delete(ProductSimilarity))
+    product_ids, matrix = _fit_product_names()
+    if product_ids:
+        db.session.execute(db.insert(ProductSimilarity), list(
+            _similarity_rows(product_ids, matrix, list(range(len(product_ids))))))
+    db.session.commit()
+
+
+def refresh_similar_products(changed_ids=(), deleted_ids=()):
+    from sklearn.metrics.pairwise import linear_kernel
+
+    changed_ids = set(changed_ids)
+    deleted_ids = set(deleted_ids)
+    touched = changed_ids | deleted_ids
+    if not touched:
+        return
+
+    # Products that currently list a changed or deleted product have to be recomputed
+    stale = {row.product_id for row in db.session.query(ProductSimilarity.product_id)
+             .filter(ProductSimilarity.similar_product_id.in_(touched))}
+    db.session.execute(db.delete(ProductSimilarity).where(
+        ProductSimilarity.product_id.in_(deleted_ids) | ProductSimilarity.similar_product_id.in_(deleted_ids)))
+
+    product_ids, matrix = _fit_product_names()
+    positions = {product_id: i for i, product_id in enumerate(product_ids)}
+    changed = [positions[product_id] for product_id in changed_ids if product_id in positions]
+
+    if changed:
+        # A changed product may now beat the weakest neighbour of any other product
+        weakest = {row.product_id: (row.score, row.count) for row in db.session.query(
+            ProductSimilarity.product_id, db.func.min(ProductSimilarity.score).label('score'),
+            db.func.count().label('count')).group_by(ProductSimilarity.product_id)}
+        scores = linear_kernel(matrix[changed], matrix).max(axis=0)
+        for product_id, position in positions.items():
+            score, count = weakest.get(product_id, (None, 0))
+            if count < SIMILARITY_INDEX_SIZE or scores[position] > score:
+                stale.add(product_id)
+
+    stale = [positions[product_id] for product_id in (stale | changed_ids) if product_id in positions]
+    if stale:
+        _write_similarity_rows([product_ids[i] for i in stale], _similarity_rows(product_ids, matrix, stale))
+    db.session.commit()
+
+
+# Share of the recommendation score that comes from names; the rest is what customers buy and view together
+NAME_SIMILARITY_WEIGHT = 0.4
+# A purchase says more than a look
+VIEW_AFFINITY_WEIGHT = 0.3
+# Views by the same user further apart than this belong to different sessions
+VIEW_SESSION_GAP = timedelta(minutes=30)
+
+
+def _basket_matrix(baskets, products, product_ids):
+    import numpy as np
+    from scipy import sparse
+
+    # One row per basket, one column per product, 1 where the basket has the product
+    products = np.asarray(products, dtype=np.int64)
+    columns = np.searchsorted(product_ids, products)
+    known = (columns < len(product_ids)) & (product_ids[np.minimum(columns, len(product_ids) - 1)] == products)
+    baskets = np.asarray(baskets, dtype=np.int64)[known]
+    _, rows = np.unique(baskets, return_inverse=True)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, columns[known])),
+                               shape=(rows.max() + 1 if len(rows) else 0, len(product_ids)))
+    matrix.data[:] = 1
+    return matrix
+
+
+def _view_sessions():
+    import numpy as np
+
+    rows = db.session.execute(db.select(ProductView.user_id, ProductView.timestamp, ProductView.product_id)
+                              .order_by(ProductView.user_id, ProductView.timestamp)).all()
+    if not rows:
+        return [], []
+    users, timestamps, products = zip(*rows)
+    users = np.asarray(users, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    new_session = np.ones(len(rows), dtype=bool)
+    new_session[1:] = (users[1:] != users[:-1]) | (np.diff(timestamps) > np.timedelta64(VIEW_SESSION_GAP))
+    return np.cumsum(new_session), products
+
+
+def rebuild_affinity_index():
+    import numpy as np
+    from scipy import sparse
+
+    product_ids = np.array(db.session.execute(db.select(Product.id).order_by(Product.id)).scalars().all(),
+                           dtype=np.int64)
+    db.session.execute(db.delete(ProductAffinity))
+    if not len(product_ids):
+        db.session.commit()
+        return
+
+    order_items = db.session.execute(db.select(OrderItem.order_id, OrderItem.product_id)).all()
+    orders = _basket_matrix([row.order_id for row in order_items], [row.product_id for row in order_items],
+                            product_ids)
+    views = _basket_matrix(*_view_sessions(), product_ids)
+    # Co-occurrence counts, cosine-normalised so best sellers don't end up next to everything
+    counts = (orders.T @ orders + VIEW_AFFINITY_WEIGHT * (views.T @ views)).tocsr()
+    norms = np.sqrt(counts.diagonal())
+    norms[norms == 0] = 1
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    scores = sparse.diags(1 / norms) @ counts @ sparse.diags(1 / norms)
+    scores = scores.tocsr()
+
+    rows = []
+    for position in range(len(product_ids)):
+        start, end = scores.indptr[position], scores.indptr[position + 1]
+        data = scores.data[start:end]
+        for i in data.argsort()[:-SIMILARITY_INDEX_SIZE - 1:-1]:
+            rows.append({'product_id': int(product_ids[position]),
+                         'related_product_id': int(product_ids[scores.indices[start + i]]),
+                         'score': float(data[i])})
+    if rows:
+        db.session.execute(db.insert(ProductAffinity), rows)
+    db.session.commit()
+
+
+# Products this worker already queued a similarity refresh for
+_similarity_requested = set()
+
+
+def get_similar_products(product):
+    # At most SIMILARITY_INDEX_SIZE candidates from each index, so this stays cheap however big the catalog gets
+    candidates = db.union_all(
+        db.select(ProductSimilarity.similar_product_id.label('id'),
+                  (ProductSimilarity.score * NAME_SIMILARITY_WEIGHT).label('score'))
+        .where(ProductSimilarity.product_id == product.id),
+        db.select(ProductAffinity.related_product_id.label('id'),
+                  (ProductAffinity.score * (1 - NAME_SIMILARITY_WEIGHT)).label('score'))
+        .where(ProductAffinity.product_id == product.id)).subquery()
+    blended = db.select(candidates.c.id, func.sum(candidates.c.score).label('score'))\
+        .group_by(candidates.c.id).subquery()
+    # Ids only, the products themselves come from the catalog snapshot; rows for products deleted since
+    # the index was built are skipped
+    query = db.select(blended.c.id).order_by(blended.c.score.desc(), blended.c.id)
+
+    def similar_products():
+        products = get_catalog().products
+        ids = db.session.execute(query).scalars()
+        return [products[product_id] for product_id in ids if product_id in products][:SIMILAR_PRODUCTS_LIMIT]
+
+    found = similar_products()
+    if len(found) < SIMILAR_PRODUCTS_LIMIT and product.id not in _similarity_requested and not db.session.query(
+            ProductSimilarity.query.filter_by(product_id=product.id).exists()).scalar():
+        # Names not indexed yet (fresh database or product written outside the admin): the job runner
+        # indexes it, this page makes do with what there is
+        enqueue_jobs('refresh_similarity', {f'refresh_similarity:product-{product.id}': {
+            'changed_ids': [product.id], 'deleted_ids': []}})
+        db.session.commit()
+        _similarity_requested.add(product.id)
+    return found
+
+
+@job_handler('rebuild_similarity', in_web_workers=False)
+def _rebuild_similarity(payload):
+    rebuild_similarity_index()
+
+
+@job_handler('refresh_similarity', in_web_workers=False)
+def _refresh_similarity(payload):
+    deleted_ids = payload['deleted_ids']
+    if deleted_ids:
+        db.session.execute(db.delete(ProductAffinity).where(
+            ProductAffinity.product_id.in_(deleted_ids) | ProductAffinity.related_product_id.in_(deleted_ids)))
+    refresh_similar_products(changed_ids=payload['changed_ids'], deleted_ids=deleted_ids)
+
+
+@click.command('rebuild-similarity')
+@with_appcontext
+def rebuild_similarity_command():
+    rebuild_similarity_index()
+    print(f'Indexed {ProductSimilarity.query.count()} similar product pairs')
+
+
+@click.command('rebuild-recommendations')
+@with_appcontext
+def rebuild_recommendations_command():
+    rebuild_affinity_index()
+    print(f'Indexed {ProductAffinity.query.count()} bought or viewed together pairs')
+
+
+VIEW_BUFFER_SIZE = 10000
+
+
+class ViewBuffer:
+    # Product views are queued in memory and inserted in batches by a background thread. Views are
+    # only a signal for recommendations: when the queue is full or a write fails they are dropped and counted.
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.dropped = 0
+        self.worker = None
+        self.app = None
+
+    def add(self, user_id, product_id):
+        with self.lock:
+            if len(self.pending) >= VIEW_BUFFER_SIZE:
+                self.dropped += 1
+                return
+            self.pending.append({'user_id': user_id, 'product_id': product_id, 'timestamp': datetime.utcnow()})
+        if not current_app.config['VIEW_FLUSH_INTERVAL']:
+            self.flush()
+        else:
+            self._start_worker(current_app._get_current_object())
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            # A product or user deleted since its views were queued would fail the whole batch on the foreign keys
+            product_ids = set(db.session.scalars(
+                db.select(Product.id).where(Product.id.in_({view['product_id'] for view in batch}))))
+            user_ids = set(db.session.scalars(db.select(User.id).where(User.id.in_({view['user_id'] for view in batch}))))
+            kept = [view for view in batch if view['product_id'] in product_ids and view['user_id'] in user_ids]
+            if len(kept) < len(batch):
+                with self.lock:
+                    self.dropped += len(batch) - len(kept)
+                batch = kept
+            if not batch:
+                return
+            # A list of parameter sets is sent as one executemany
+            db.session.execute(db.insert(ProductView), batch)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self.lock:
+                self.dropped += len(batch)
+            raise
+
+    def _start_worker(self, app):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.app = app
+                self.worker = threading.Thread(target=self._run, args=(app,), name='view-flush', daemon=True)
+                self.worker.start()
+
+    def _run(self, app):
+        reported = 0
+        while True:
+            time.sleep(app.config['VIEW_FLUSH_INTERVAL'] or 1)
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Writing product views failed')
+            if self.dropped != reported:
+                reported = self.dropped
+                app.logger.warning('%d product views dropped so far', reported)
+
+
+view_buffer = ViewBuffer()
+os.register_at_fork(after_in_child=view_buffer.reset)
+COUNTERS['shop_product_views_dropped_total'] = lambda: view_buffer.dropped
+
+
+@atexit.register
+def flush_view_buffer():
+    if view_buffer.app is not None:
+        with view_buffer.app.app_context():
+            view_buffer.flush()
@@ -0,0 +1,113 @@
+import re
+import unicodedata
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func
+
+from shop.catalog import get_catalog
+from shop.models import Product, db
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+
+def _fold(expression):
+    # unicode61 strips tone marks but treats đ as its own letter
+    return f"replace(replace({expression}, 'đ', 'd'), 'Đ', 'D')"
+
+
+def _bare_letter(char):
+    base = unicodedata.normalize('NFD', char)[0]
+    return base if char.isalpha() and base != char and base.isascii() else None
+
+
+# Accented Latin letters, Vietnamese's among them, and their bare forms. FTS5 folds its index and the
+# search terms itself; the fallback for other backends folds both sides with translate()
+_ACCENTED = ''.join(char for char in map(chr, range(0xC0, 0x1EFA)) if _bare_letter(char)) + 'đĐ'
+_BARE = ''.join(map(_bare_letter, _ACCENTED[:-2])) + 'dD'
+_FOLD = str.maketrans(_ACCENTED, _BARE)
+
+
+SEARCH_INDEX_SQL = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS product_search
+    USING fts5(name, type_name, tokenize="unicode61 remove_diacritics 2", prefix="2 3")''',
+    f'''CREATE TRIGGER IF NOT EXISTS product_search_insert AFTER INSERT ON product BEGIN
+        INSERT INTO product_search (rowid, name, type_name)
+        VALUES (new.id, {_fold('new.name')}, (SELECT {_fold('name')} FROM product_type WHERE id = new.model));
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS product_search_update AFTER UPDATE OF name, model ON product BEGIN
+        UPDATE product_search SET name = {_fold('new.name')},
+        type_name = (SELECT {_fold('name')} FROM product_type WHERE id = new.model)
+        WHERE rowid = new.id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS product_search_delete AFTER DELETE ON product BEGIN
+        DELETE FROM product_search WHERE rowid = old.id;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS product_type_search_update AFTER UPDATE OF name ON product_type BEGIN
+        UPDATE product_search SET type_name = {_fold('new.name')}
+        WHERE rowid IN (SELECT id FROM product WHERE model = new.id);
+    END''',
+]
+
+
+_search_index_ready = False
+
+
+def rebuild_search_index():
+    db.session.execute(db.text('DELETE FROM product_search'))
+    db.session.execute(db.text(f'''INSERT INTO product_search (rowid, name, type_name)
+    SELECT product.id, {_fold('product.name')}, {_fold('product_type.name')}
+    FROM product LEFT JOIN product_type ON product_type.id = product.model'''))
+    db.session.commit()
+
+
+def ensure_search_index():
+    global _search_index_ready
+    if _search_index_ready or db.engine.dialect.name != 'sqlite':
+        return
+    for statement in SEARCH_INDEX_SQL:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+    # The triggers keep the index in sync from here on; fill it once for existing rows
+    indexed = db.session.execute(db.text('SELECT count(*) FROM product_search')).scalar()
+    if not indexed and Product.query.first():
+        rebuild_search_index()
+    _search_index_ready = True
+
+
+def search_products(search_text, page=1, per_page=SEARCH_PAGE_SIZE):
+    terms = re.findall(r'\w+', search_text.translate(_FOLD))
+    offset = (page - 1) * per_page
+    catalog = get_catalog()
+    if not terms:
+        products = catalog.listing()[offset:offset + per_page + 1]
+        return list(products[:per_page]), len(products) > per_page
+
+    if db.engine.dialect.name != 'sqlite':
+        # No FTS5 on this backend: substring match on the name with its accents folded like the terms
+        name = func.translate(Product.name, _ACCENTED, _BARE)
+        ids = db.session.execute(db.select(Product.id).where(*[name.ilike(f'%{term}%') for term in terms])
+                                 .order_by(Product.id).offset(offset).limit(per_page + 1)).scalars().all()
+        products = [catalog.products[product_id] for product_id in ids[:per_page] if product_id in catalog.products]
+        return products, len(ids) > per_page
+
+    ensure_search_index()
+    # Every term has to match the start of a word in the name or category
+    match = ' '.join(f'"{term}"*' for term in terms)
+    ids = db.session.execute(db.text('''SELECT rowid FROM product_search WHERE product_search MATCH :match
+    ORDER BY bm25(product_search, 10.0, 1.0) LIMIT :limit OFFSET :offset'''),
+                             {'match': match, 'limit': per_page + 1, 'offset': offset}).scalars().all()
+    return [catalog.products[product_id] for product_id in ids[:per_page] if product_id in catalog.products], \
+        len(ids) > per_page
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    if db.engine.dialect.name != 'sqlite':
+        print('Full-text search needs SQLite FTS5, searches use ILIKE on this database')
+        return
+    ensure_search_index()
+    rebuild_search_index()
+    print('Rebuilt the product search index')
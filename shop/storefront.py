@@ -0,0 +1,347 @@
+import functools
+import threading
+import time
+from collections import OrderedDict, deque
+from flask import Blueprint, current_app, render_template, request, redirect, url_for, session, flash, \
+    make_response, abort
+from flask_wtf import FlaskForm
+from sqlalchemy.orm import joinedload, selectinload
+from wtforms import StringField, PasswordField, validators
+from wtforms.validators import InputRequired, Length, Email, EqualTo
+from sqlalchemy import func
+
+from shop.cart import get_cart_summary
+from shop.catalog import cached_page, get_best_sellers, get_catalog, get_product_types
+from shop.metrics import COUNTERS
+from shop.models import Contact, Order, OrderItem, User, db
+from shop.orders import get_order_statuses
+from shop.pagination import get_page_args
+from shop.recommendations import get_similar_products, view_buffer
+from shop.search import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, search_products
+
+bp = Blueprint('storefront', __name__)
+
+
+@bp.route('/')
+def homepage():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        session['cart'] = get_cart_summary(user_id).item_count
+    else:
+        session['cart'] = 0
+    top_products = get_best_sellers()
+    return render_template('/user/trangchu.html', top_products=top_products)
+
+
+@bp.route('/contact')
+@cached_page
+def contact():
+    return render_template('/user/contact.html')
+
+
+@bp.route('/cauchuyen')
+@cached_page
+def cauchuyen():
+    return render_template('/user/cauchuyen.html')
+
+
+@bp.route('/tracaphechung')
+@cached_page
+def tracaphechung():
+    return render_template('/user/tracaphechung.html')
+
+
+@bp.route('/tra')
+@cached_page
+def tra():
+    return render_template('/user/tra.html')
+
+
+@bp.route('/caphe')
+@cached_page
+def caphe():
+    return render_template('/user/caphe.html')
+
+
+login_metrics = {'hash_count': 0, 'hash_seconds': 0.0, 'rehashed': 0, 'failed': 0, 'throttled': 0}
+for key in login_metrics:
+    COUNTERS[f'shop_login_{key}_total'] = functools.partial(login_metrics.get, key)
+
+
+class LoginThrottle:
+    # Sliding window of recent failed logins per key, kept in this worker's memory. Keys are ordered by
+    # their latest failure, so the expired ones, and the ones evicted to stay under max_keys, are at the front
+    max_keys = 100000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = OrderedDict()
+
+    def _recent(self, key, now):
+        attempts = self.failures.get(key)
+        if attempts is None:
+            return 0
+        while attempts and now - attempts[0] > current_app.config['LOGIN_THROTTLE_WINDOW']:
+            attempts.popleft()
+        if not attempts:
+            del self.failures[key]
+            return 0
+        return len(attempts)
+
+    def allow(self, limits):
+        now = time.monotonic()
+        with self.lock:
+            return all(self._recent(key, now) < limit for key, limit in limits.items())
+
+    def failed(self, keys):
+        now = time.monotonic()
+        window = current_app.config['LOGIN_THROTTLE_WINDOW']
+        with self.lock:
+            for key in keys:
+                self.failures.setdefault(key, deque()).append(now)
+                self.failures.move_to_end(key)
+            while self.failures:
+                latest = next(iter(self.failures.values()))[-1]
+                if len(self.failures) <= self.max_keys and now - latest <= window:
+                    break
+                self.failures.popitem(last=False)
+
+    def clear(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+
+
+login_throttle = LoginThrottle()
+
+
+def check_password(user, password):
+    started = time.perf_counter()
+    try:
+        return user.check_password(password)
+    finally:
+        login_metrics['hash_count'] += 1
+        login_metrics['hash_seconds'] += time.perf_counter() - started
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        phone_number = request.form['phone_number']
+        password = request.form['password']
+        limits = {('phone', phone_number): current_app.config['LOGIN_MAX_FAILURES_PER_PHONE']}
+        if current_app.config['LOGIN_MAX_FAILURES_PER_IP']:
+            limits['ip', request.remote_addr] = current_app.config['LOGIN_MAX_FAILURES_PER_IP']
+        # Checked before the user lookup and the (deliberately slow) password hash
+        if not login_throttle.allow(limits):
+            login_metrics['throttled'] += 1
+            flash('Bạn đã đăng nhập sai quá nhiều lần, vui lòng thử lại sau ít phút', 'danger')
+            return render_template('/user/login.html'), 429
+        user = User.query.filter_by(phone_number=phone_number).first()
+
+        if user and check_password(user, password):
+            login_throttle.clear(('phone', phone_number))
+            if user.needs_rehash():
+                user.set_password(password)
+                db.session.commit()
+                login_metrics['rehashed'] += 1
+            obj_user = {
+                "id": user.id,
+                "name": user.name,
+                "phone_number": user.phone_number,
+                "role": user.role
+            }
+            session['current_user'] = obj_user
+            flash(f'Đăng nhập thành công! Chào mừng {user.name}', 'success')
+            return render_template('/user/trangchu.html', show_user_section=True)
+        else:
+            login_throttle.failed(limits)
+            login_metrics['failed'] += 1
+            return render_template('/user/login.html')
+    if 'current_user' in session:
+        return redirect(url_for('.homepage'))
+    else:
+        return render_template('/user/login.html')
+
+
+@bp.route('/logout')
+def logout():
+    session.pop('current_user', None)
+    return redirect(url_for('.homepage'))
+
+
+class RegistrationForm(FlaskForm):
+    name = StringField('Họ và tên', validators=[
+        InputRequired(),
+        Length(min=3, message="Tên phải có ít nhất 3 ký tự")
+    ])
+    email = StringField('Email', validators=[
+        InputRequired(),
+        Email(message="Email không đúng định dạng")
+    ])
+    phone_number = StringField('Số điện thoại', validators=[
+        InputRequired(),
+        Length(min=10, max=10, message="Số điện thoại phải có đúng 10 ký tự"),
+        validators.Regexp(r'^[0-9]*$', message="Số điện thoại chỉ chứa số")
+    ])
+    password = PasswordField('Mật khẩu', validators=[
+        InputRequired(),
+        Length(min=8, message="Mật khẩu phải có ít nhất 8 ký tự")
+    ])
+    confirm_password = PasswordField('Xác nhận mật khẩu', validators=[
+        InputRequired(),
+        EqualTo('password', message="Mật khẩu không khớp")
+    ])
+
+
+@bp.route('/register', methods=['GET', 'POST'])
+def register():
+    if 'current_user' in session:
+        return redirect(url_for('.homepage'))
+    else:
+        form = RegistrationForm()
+        if form.validate_on_submit():
+            name = form.name.data
+            email = form.email.data
+            phone_number = form.phone_number.data
+            password = form.password.data
+
+            # Check if the email or phone number is already in use
+            if User.query.filter_by(email=email).first() or User.query.filter_by(phone_number=phone_number).first():
+                flash('Email or phone number is already in use', 'error')
+            else:
+                user = User(name, email, phone_number, password)
+                user.role = 'user'
+                db.session.add(user)
+                db.session.commit()
+                flash('Đăng ký thành công!', 'success')
+                return redirect(url_for('.login'))
+        return render_template('user/register.html', form=form)
+
+
+@bp.route('/profile', methods=['GET', 'POST'])
+def profile():
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        user = User.query.get(user_id)
+
+        if request.method == 'POST':
+            name = request.form['name']
+            email = request.form['email']
+            phone_number = request.form['phone_number']
+
+            user.update_profile(name, email, phone_number)
+
+            flash('Profile updated successfully!', 'success')
+            return redirect(url_for('.profile'))
+
+        return render_template('user/update_profile.html', user=user)
+    else:
+        flash('You need to log in!', 'info')
+        return redirect(url_for('.login'))
+
+
+@bp.route('/submit_contact', methods=['POST'])
+def submit_contact():
+    if request.method == 'POST':
+        name = request.form.get('name')
+        phone_number = request.form.get('number')
+        city = request.form.get('dinoselect')
+        shop = request.form.get('shop')
+        title = request.form.get('tieude')
+        message = request.form.get('message')
+
+        # Create a new Contact instance and add it to the database
+        contact = Contact(name=name, phone_number=phone_number, city=city, shop=shop, title=title, message=message)
+        db.session.add(contact)
+        db.session.commit()
+
+        return redirect('/contact')
+
+
+@bp.route('/product/', defaults={'typeid': None}, methods=['GET'])
+@bp.route('/product/<int:typeid>/', methods=['GET'])
+@cached_page
+def product(typeid):
+    sort_by = request.args.get('sort_by', '')
+    sort_order = request.args.get('sort_order', '')
+    products = list(get_catalog().listing(typeid, sort_order, sort_by))
+    return render_template('user/product.html', data=products, drink_types=get_product_types())
+
+
+@bp.route('/product/search', methods=['GET', 'POST'])
+def search():
+    if request.method == 'POST':
+        return redirect(url_for('.search', q=request.form.get('searchInput', '')))
+
+    search_text = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    products, has_next = search_products(search_text, page, per_page)
+
+    response = make_response(render_template('user/product.html', data=products, drink_types=get_product_types(),
+                                              search_text=search_text, page=page, per_page=per_page,
+                                              has_next=has_next))
+    response.cache_control.max_age = 60
+    if 'current_user' in session:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    return response
+
+
+@bp.route('/product/details/<int:productid>/', methods=['GET'])
+def product_details(productid):
+    product = get_catalog().products.get(productid)
+    if product is None:
+        abort(404)
+    similar_products = get_similar_products(product)
+    if 'current_user' in session:
+        view_buffer.add(session['current_user']['id'], product.id)
+
+    return render_template('user/product_details.html', product=product, similar_products=similar_products)
+
+
+@bp.route('/order_history/', defaults={'statusid': None}, methods=['GET'])
+@bp.route('/order_history/<int:statusid>/', methods=['GET'])
+def order_history(statusid):
+    if 'current_user' in session:
+        user_id = session['current_user']['id']
+        cursor, limit = get_page_args()
+        query = Order.query.options(selectinload(Order.products), joinedload(Order.order_status))\
+            .filter_by(user_id=user_id)
+        if statusid != None:
+            query = query.filter_by(status_id=statusid)
+        if cursor is not None:
+            # Newest first by date, in the order of ix_order_user_status_date; the cursor is the last order's id
+            cursor_date = db.select(Order.order_date).where(Order.id == cursor).scalar_subquery()
+            query = query.filter(db.or_(Order.order_date < cursor_date,
+                                        db.and_(Order.order_date == cursor_date, Order.id < cursor)))
+        customer_orders = query.order_by(Order.order_date.desc(), Order.id.desc()).limit(limit + 1).all()
+        next_cursor = customer_orders[limit - 1].id if len(customer_orders) > limit else None
+
+        # Counts for every status tab in one pass over the index
+        status_counts = dict(db.session.query(Order.status_id, func.count(Order.id))
+                             .filter_by(user_id=user_id).group_by(Order.status_id).all())
+        return render_template('user/order_history.html', orders=customer_orders[:limit],
+                               order_statuses=get_order_statuses(), status_counts=status_counts,
+                               total_orders=sum(status_counts.values()), next_cursor=next_cursor, limit=limit)
+    else:
+        return redirect(url_for('.login'))
+
+
+@bp.route('/orders/<int:order_id>/')
+def order_details(order_id):
+    if 'current_user' in session:
+        query = Order.query.options(selectinload(Order.products).joinedload(OrderItem.product))\
+            .filter_by(id=order_id)
+        if session['current_user']['role'] != 'admin':
+            # Part of the same query: someone else's order looks exactly like a missing one
+            query = query.filter_by(user_id=session['current_user']['id'])
+        order = query.first()
+        if order is None:
+            abort(404)
+        order_items = order.products
+        item_images = [order_item.product.picture for order_item in order_items]
+        return render_template('user/order_details.html', order=order, order_items=order_items, images=item_images)
+    else:
+        return redirect(url_for('.login'))